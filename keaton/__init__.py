@@ -1 +1,7 @@
-from .keaton import Keaton
+def __getattr__(name):
+    # La ventana se importa al pedirla: así `python -m keaton` y los procesos
+    # de trabajo no cargan Qt
+    if name == "Keaton":
+        from .keaton import Keaton
+        return Keaton
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
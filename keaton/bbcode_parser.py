@@ -1,9 +1,9 @@
-import json
-import os
-
 import bbcode
 import html
 import re
+import threading
+
+from .roll_store import get_roll_store
 
 COLOR_MAP = {
     "#3366cc": "#2980b9",  # azul fuerte → azul más usable
@@ -13,6 +13,14 @@ COLOR_MAP = {
 }
 
 
+# Subir cuando cambie el HTML que genera el parser (o fast_bbcode), para
+# invalidar las cachés de HTML; es lo único del código que las invalida
+PARSER_VERSION = 1
+
+_parser = None
+_parser_lock = threading.Lock()
+
+
 def normalize_color(value: str) -> str:
     if not value:
         return "inherit"
@@ -20,65 +28,28 @@ def normalize_color(value: str) -> str:
     return COLOR_MAP.get(color, color)
 
 
-def build_bbcode_parser():
-    parser = bbcode.Parser()
+def simple_formatter(template):
+    """Formatter que rellena `template` con las opciones y el contenido."""
+    def render(tag_name, value, options, parent, context):
+        fmt = {}
+        if options:
+            fmt.update(options)
+        fmt["value"] = value
+        return template % fmt
+    return render
 
-    # Negrita, cursiva, subrayado
-    parser.add_simple_formatter("b", "<b>%(value)s</b>")
-    parser.add_simple_formatter("i", "<i>%(value)s</i>")
-    parser.add_simple_formatter("u", "<u>%(value)s</u>")
 
-    # Extras
-    parser.add_simple_formatter("googlesm", '%(value)s')
-    parser.add_simple_formatter("googlefont", '%(value)s')
+def render_url(tag_name, value, options, parent, context):
+    return f"<a href='{clean_url(options.get(tag_name, ''))}'>{value}</a>"
 
-    # Separadores
-    parser.add_simple_formatter("hr", "<hr>", standalone=True)
-    parser.add_simple_formatter("lh", "<hr>")
-
-    # Quote sin autor
-    parser.add_simple_formatter("quote", "<blockquote>%(value)s</blockquote>")
-
-    # Quote con autor → aquí está el fix
-    parser.add_formatter(
-        "quote",
-        render_func=render_quote,
-        standalone=False,
-        same_tag_closes=True,
-        strip=True
-    )
-
-    parser.add_formatter(
-        "dice",
-        render_func=load_roll_by_id,
-        standalone=False,
-        same_tag_closes=True,
-        strip=True
-    )
-
-    parser.add_formatter(
-        "url",
-        render_func=lambda tag_name, value, options, parent, context:
-            f"<a href='{clean_url(options.get(tag_name, ''))}'>{value}</a>",
-        standalone=False,
-        same_tag_closes=True,
-        strip=True
-    )
 
-    # Colores [color=#ff0000]texto[/color]
-    parser.add_formatter(
-        "color",
-        render_func=lambda tag_name, value, options, parent, context:
-            f"<span style='color:{normalize_color(options.get(tag_name,'black'))}'>{value}</span>",
-        standalone=False,
-        strip=True
-    )
-
-    # Spoiler
-    parser.add_formatter(
-        "spoiler",
-        render_func=lambda tag_name, value, options, parent, context:
-        f"""
+def render_color(tag_name, value, options, parent, context):
+    color = normalize_color(options.get(tag_name, 'black'))
+    return f"<span style='color:{color}'>{value}</span>"
+
+
+def render_spoiler(tag_name, value, options, parent, context):
+    return f"""
                 <table border="0" cellspacing="0" cellpadding="0" width="100%">
                     <tr>
                         <td width="30"></td>
@@ -88,68 +59,36 @@ def build_bbcode_parser():
                         </td>
                     </tr>
                 </table>
-                """,
-        standalone=False,
-        strip=True
-    )
-
-    parser.add_formatter(
-        "img",
-        replace_links=False,
-        render_func=lambda tag_name, value, options, parent, context: (
-            f'<a href="{clean_url(value.strip())}"><img src="{clean_url(value.strip())}" style="max-width:100%; max-height:400px;"></a>'
-        ),
-        standalone=False,
-        strip=True
-    )
-
-    parser.add_formatter(
-        "image",
-        replace_links=False,
-        render_func=lambda tag_name, value, options, parent, context: (
-            f'<a href="{clean_url(value.strip())}"><img src="{clean_url(value.strip())}" style="max-width:100%; max-height:400px;"></a>'
-        ),
-        standalone=False,
-        strip=True
-    )
-
-    parser.add_formatter(
-        "imagen",
-        replace_links=False,
-        render_func=lambda tag_name, value, options, parent, context: (
-            f'<a href="{clean_url(value.strip())}"><img src="{clean_url(value.strip())}" style="max-width:100%; max-height:400px;"></a>'
-        ),
-        standalone=False,
-        strip=True
-    )
-
-    parser.add_formatter(
-        "centre",
-        render_func=lambda tag_name, value, options, parent, context: (
-            f'<div style="text-align:center">{value}</div>'
-        ),
-        standalone=False,
-        strip=True
-    )
-
-    parser.add_formatter(
-        "size",
-        render_func=render_size,
-        standalone=False,
-        strip=True
-    )
-
-    parser.add_formatter(
-        "youtube",
-        render_func=lambda tag_name, value, options, parent, context: (
-            f'<a href="https://www.youtube.com/watch?v={value.strip()}" '
-            f'style="color:#e74c3c; text-decoration:none;">🎬 Ver en YouTube</a>'
-        ),
-        standalone=False,
-        strip=True
-    )
+                """
 
-    return parser
+
+def render_image(tag_name, value, options, parent, context):
+    url = clean_url(value.strip())
+    return (f'<a href="{url}"><img src="{url}" '
+            f'style="max-width:100%; max-height:400px;"></a>')
+
+
+def render_centre(tag_name, value, options, parent, context):
+    return f'<div style="text-align:center">{value}</div>'
+
+
+def render_youtube(tag_name, value, options, parent, context):
+    return (f'<a href="https://www.youtube.com/watch?v={value.strip()}" '
+            f'style="color:#e74c3c; text-decoration:none;">🎬 Ver en YouTube</a>')
+
+
+def get_parser():
+    """Parser compartido; se construye una sola vez (format no guarda estado)."""
+    global _parser
+    if _parser is None:
+        with _parser_lock:
+            if _parser is None:
+                _parser = build_bbcode_parser()
+    return _parser
+
+
+def render_message(message):
+    return get_parser().format(message)
 
 
 def render_size(tag_name, value, options, parent, context):
@@ -203,11 +142,54 @@ def clean_url(url: str) -> str:
 
 def load_roll_by_id(tag_name, value, options, parent, context):
     text = "<b>Tirada no encontrada</b>"
-    with open(os.path.join("data", "rolls.json"), "r", encoding="utf-8") as f:
-        rolls = json.loads(f.read())
-    roll = next((roll for roll in rolls if roll.get("dice_code") == value), None)
+    roll = get_roll_store().by_code(value)
     if roll:
         text = (f"<b>Resultados de la tirada "
                 f"{roll.get('numdice')}d{roll.get('numsides')}:</b>"
                 f" {', '.join(roll.get('totalroll').rstrip(':').split(':'))}")
-    return text
\ No newline at end of file
+    return text
+
+
+# (etiqueta, función, opciones) que se añaden a los formatters por defecto de
+# bbcode.Parser; fast_bbcode usa la misma tabla
+FORMATTERS = [
+    # Negrita, cursiva, subrayado
+    ("b", simple_formatter("<b>%(value)s</b>"), {}),
+    ("i", simple_formatter("<i>%(value)s</i>"), {}),
+    ("u", simple_formatter("<u>%(value)s</u>"), {}),
+
+    # Extras
+    ("googlesm", simple_formatter("%(value)s"), {}),
+    ("googlefont", simple_formatter("%(value)s"), {}),
+
+    # Separadores
+    ("hr", simple_formatter("<hr>"), {"standalone": True}),
+    ("lh", simple_formatter("<hr>"), {}),
+
+    # Quote con o sin autor
+    ("quote", render_quote, {"same_tag_closes": True, "strip": True}),
+
+    ("dice", load_roll_by_id, {"same_tag_closes": True, "strip": True}),
+    ("url", render_url, {"same_tag_closes": True, "strip": True}),
+
+    # Colores [color=#ff0000]texto[/color]
+    ("color", render_color, {"strip": True}),
+
+    ("spoiler", render_spoiler, {"strip": True}),
+
+    # Imágenes: [img], [image] e [imagen] son la misma etiqueta
+    ("img", render_image, {"replace_links": False, "strip": True}),
+    ("image", render_image, {"replace_links": False, "strip": True}),
+    ("imagen", render_image, {"replace_links": False, "strip": True}),
+
+    ("centre", render_centre, {"strip": True}),
+    ("size", render_size, {"strip": True}),
+    ("youtube", render_youtube, {"strip": True}),
+]
+
+
+def build_bbcode_parser():
+    parser = bbcode.Parser()
+    for tag_name, render_func, options in FORMATTERS:
+        parser.add_formatter(tag_name, render_func, **options)
+    return parser
@@ -0,0 +1,205 @@
+"""Línea de órdenes de Keaton: `python -m keaton <orden>`.
+
+Funciona sin interfaz gráfica: nada de lo que se importa aquí carga Qt.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+
+from .export import POSTS_PER_PAGE, export_thread, thread_title
+from .global_search import (MAX_HITS_PER_THREAD, search_thread,
+                            search_threads, thread_files)
+from .html_cache import HtmlStore
+from .process_pool import make_executor
+from .render_cache import RenderCache
+from .search_index import TrigramIndex, WordIndex
+from .thread_store import STORE_SUFFIX, ThreadStore
+from .utils import BADGE_MINI_UPDATE, BADGE_UPDATE, format_date
+
+THREADS_DIR = "threads"
+PROGRESS_STEP = 25
+
+
+def resolve_thread(threads_dir, value):
+    """Archivo de un hilo a partir de su ruta, su id o parte de su nombre."""
+    if os.path.isfile(value):
+        return value
+    files = thread_files(threads_dir)
+    if value.isdigit():
+        matches = [f for f in files if f.split("#")[0] == value]
+    else:
+        needle = value.lower()
+        matches = [f for f in files if needle in f.lower()]
+    if len(matches) != 1:
+        found = ", ".join(matches) if matches else "ninguno"
+        raise ValueError(f"'{value}' no identifica un solo hilo ({found})")
+    return os.path.join(threads_dir, matches[0])
+
+
+def selected_threads(args):
+    if args.threads:
+        return [resolve_thread(args.threads_dir, t) for t in args.threads]
+    return [os.path.join(args.threads_dir, f)
+            for f in thread_files(args.threads_dir)]
+
+
+def cmd_search(args):
+    if args.thread:
+        results = [search_thread(resolve_thread(args.threads_dir, args.thread),
+                                 args.query, args.limit)]
+    else:
+        def on_error(filename, error):
+            print(f"{filename}: {error}", file=sys.stderr)
+
+        results = sorted(
+            search_threads(args.threads_dir, args.query, on_error=on_error),
+            key=lambda result: int(os.path.basename(result[0]).split("#")[0]))
+    total_hits = 0
+    for json_file, total, hits in results:
+        if not total:
+            continue
+        total_hits += total
+        title = thread_title(json_file)
+        shown = hits[:args.limit]
+        for post_id, snippet in shown:
+            print(f"{title} #{post_id}: {snippet}")
+        if total > len(shown):
+            print(f"{title}: {total - len(shown)} resultados más")
+    print(f"{total_hits} resultados", file=sys.stderr)
+    return 0
+
+
+def cmd_stats(args):
+    for json_file in selected_threads(args):
+        store = ThreadStore.open(json_file)
+        try:
+            users = Counter()
+            badges = Counter()
+            dates = []
+            chars = 0
+            for post in store:
+                users[post["username"]] += 1
+                badges[post["badge"]] += 1
+                dates.append(post["post_date"])
+                chars += len(post["message"])
+        finally:
+            store.close()
+        print(f"{thread_title(json_file)} ({os.path.basename(json_file)})")
+        print(f"  posts: {len(dates)}")
+        if dates:
+            print(f"  desde: {format_date(min(dates))}"
+                  f"  hasta: {format_date(max(dates))}")
+        print(f"  actualizaciones: {badges[BADGE_UPDATE]}"
+              f"  miniactualizaciones: {badges[BADGE_MINI_UPDATE]}")
+        print(f"  caracteres: {chars}")
+        print("  usuarios:")
+        for username, count in users.most_common(args.top):
+            print(f"    {username:<24} {count}")
+    return 0
+
+
+def cmd_export(args):
+    json_file = resolve_thread(args.threads_dir, args.thread)
+
+    def progress(done, total):
+        if done % PROGRESS_STEP == 0 or done == total:
+            print(f"\r{done} / {total} posts", end="", file=sys.stderr)
+
+    start = time.perf_counter()
+    pages = export_thread(json_file, args.output,
+                          posts_per_page=args.posts_per_page,
+                          progress=progress)
+    print(f"\n{args.output}: {pages} páginas en "
+          f"{time.perf_counter() - start:.1f} s", file=sys.stderr)
+    return 0
+
+
+def cmd_build_index(args):
+    # un solo grupo de procesos para normalizar todos los hilos
+    executor = make_executor() if (os.cpu_count() or 1) > 1 else None
+    try:
+        for json_file in selected_threads(args):
+            start = time.perf_counter()
+            if args.rebuild:
+                for suffix in (STORE_SUFFIX, WordIndex.SUFFIX,
+                               TrigramIndex.SUFFIX):
+                    if os.path.exists(json_file + suffix):
+                        os.remove(json_file + suffix)
+            store = ThreadStore.open(json_file, executor=executor)
+            try:
+                WordIndex.open(json_file, store)
+                TrigramIndex.open(json_file, store)
+                if args.html:
+                    cache = RenderCache(disk=HtmlStore(json_file))
+                    cache.prewarm(store)
+                    cache.set_disk(None)
+                count = len(store)
+            finally:
+                store.close()
+            print(f"{os.path.basename(json_file)}: {count} posts en "
+                  f"{time.perf_counter() - start:.2f} s")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m keaton",
+        description="Keaton sin interfaz: búsqueda, estadísticas y "
+                    "exportación de los juegos.")
+    parser.add_argument("--threads-dir", default=THREADS_DIR,
+                        help="carpeta de los hilos (por defecto: threads)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    search = commands.add_parser(
+        "search", help="buscar en un juego o en todos",
+        description="Acepta la misma sintaxis que el buscador: user:, "
+                    "after:, before:, badge: y \"frases exactas\".")
+    search.add_argument("query")
+    search.add_argument("-t", "--thread",
+                        help="id, nombre o archivo del juego")
+    search.add_argument("-n", "--limit", type=int,
+                        default=MAX_HITS_PER_THREAD,
+                        help="resultados mostrados por juego")
+    search.set_defaults(func=cmd_search)
+
+    stats = commands.add_parser("stats", help="estadísticas de los juegos")
+    stats.add_argument("threads", nargs="*",
+                       help="id, nombre o archivo (por defecto, todos)")
+    stats.add_argument("--top", type=int, default=10,
+                       help="usuarios mostrados")
+    stats.set_defaults(func=cmd_stats)
+
+    export = commands.add_parser(
+        "export", help="exportar un juego a HTML o EPUB",
+        description="Si la salida termina en .epub se genera un EPUB; si "
+                    "no, una carpeta de páginas HTML.")
+    export.add_argument("thread", help="id, nombre o archivo del juego")
+    export.add_argument("output")
+    export.add_argument("--posts-per-page", type=int,
+                        default=POSTS_PER_PAGE)
+    export.set_defaults(func=cmd_export)
+
+    build = commands.add_parser(
+        "build-index", help="preparar almacenes e índices de búsqueda")
+    build.add_argument("threads", nargs="*",
+                       help="id, nombre o archivo (por defecto, todos)")
+    build.add_argument("--rebuild", action="store_true",
+                       help="rehacerlos aunque estén al día")
+    build.add_argument("--html", action="store_true",
+                       help="renderizar también la caché de HTML")
+    build.set_defaults(func=cmd_build_index)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        return args.func(args)
+    except ValueError as e:
+        parser.error(str(e))
@@ -0,0 +1,349 @@
+import html
+import itertools
+import math
+import os
+import re
+import uuid
+import zipfile
+from collections import deque
+from datetime import datetime, timezone
+from html.parser import HTMLParser
+from pathlib import Path
+
+from .fast_bbcode import render_message
+from .process_pool import make_executor
+from .thread_store import ThreadStore
+from .utils import format_date, get_user_color
+
+POSTS_PER_PAGE = 50
+RENDER_CHUNK = 25
+# Lotes en vuelo por proceso: si escribir va más lento que renderizar, los
+# resultados no se acumulan en memoria
+CHUNKS_PER_WORKER = 2
+
+PAGE_CSS = """
+body { max-width: 50em; margin: 0 auto; padding: 1em;
+       font-family: sans-serif; line-height: 1.5; }
+.post { border-bottom: 1px solid #ccc; padding: 1em 0; }
+.post header { margin-bottom: .5em; }
+.post .date { color: #7f8c8d; font-size: .9em; }
+nav { margin: 1em 0; text-align: center; }
+img { max-width: 100%; }
+"""
+
+# Almacenes abiertos en cada proceso de trabajo
+_stores = {}
+
+
+def thread_title(json_file):
+    return Path(os.path.basename(json_file).split("#")[-1]).stem
+
+
+def page_name(number):
+    return f"pagina-{number:04d}"
+
+
+def _store_for(json_file):
+    stat = os.stat(json_file)
+    store = _stores.get(json_file)
+    if store is not None:
+        if (store.source_size, store.source_mtime) == (stat.st_size,
+                                                       stat.st_mtime_ns):
+            return store
+        store.close()
+    store = ThreadStore.open(json_file)
+    _stores[json_file] = store
+    return store
+
+
+def render_rows(json_file, start, stop, xhtml=False):
+    """Renderiza las filas [start, stop) del hilo.
+
+    Devuelve [(post_id, username, post_date, html)]; [dice] se resuelve con
+    las tiradas guardadas, igual que en el visor. Con `xhtml` el HTML se
+    convierte además a XHTML.
+    """
+    store = _store_for(json_file)
+    posts = []
+    for row in range(start, stop):
+        post = store[row]
+        body = render_message(post["message"])
+        if xhtml:
+            body = to_xhtml(body)
+        posts.append((post["post_id"], post["username"], post["post_date"],
+                      body))
+    return posts
+
+
+def rendered_posts(json_file, count, executor, chunk=RENDER_CHUNK,
+                   xhtml=False):
+    """Genera los posts renderizados en orden, repartidos por lotes.
+
+    Sólo hay unos pocos lotes pendientes a la vez, de modo que la memoria no
+    depende del tamaño del hilo.
+    """
+    window = CHUNKS_PER_WORKER * (os.cpu_count() or 1)
+    starts = iter(range(0, count, chunk))
+
+    def submit(start):
+        return executor.submit(render_rows, json_file, start,
+                               min(start + chunk, count), xhtml)
+
+    pending = deque(submit(start) for start in itertools.islice(starts,
+                                                                window))
+    while pending:
+        posts = pending.popleft().result()
+        start = next(starts, None)
+        if start is not None:
+            pending.append(submit(start))
+        yield from posts
+
+
+def post_html(post_id, username, post_date, body):
+    return (f'<div class="post" id="post-{post_id}">\n'
+            f'<header><b style="color:{get_user_color(username)}">'
+            f'{html.escape(username)}</b> '
+            f'<span class="date">{format_date(post_date)}</span></header>\n'
+            f'<div class="message">{body}</div>\n</div>\n')
+
+
+class XhtmlWriter(HTMLParser):
+    """Convierte el HTML del renderizador en XHTML bien formado para EPUB.
+
+    Cierra las etiquetas vacías (<br>, <hr>, <img>), cierra las que queden
+    abiertas y cambia las entidades de HTML por sus caracteres.
+    """
+    VOID = {"area", "base", "br", "col", "hr", "img", "input", "link", "meta",
+            "source", "wbr"}
+    INVALID_XML = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.stack = []
+
+    def _text(self, text):
+        return html.escape(self.INVALID_XML.sub("", text), quote=True)
+
+    def _tag(self, tag, attrs, close=False):
+        attributes = "".join(
+            f' {name}="{self._text(value if value is not None else name)}"'
+            for name, value in attrs)
+        self.parts.append(f"<{tag}{attributes}{' /' if close else ''}>")
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.VOID:
+            self._tag(tag, attrs, close=True)
+        else:
+            self._tag(tag, attrs)
+            self.stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self._tag(tag, attrs, close=True)
+
+    def handle_endtag(self, tag):
+        if tag not in self.stack:
+            return
+        while self.stack:
+            open_tag = self.stack.pop()
+            self.parts.append(f"</{open_tag}>")
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        self.parts.append(self._text(data))
+
+    def convert(self, text):
+        self.feed(text)
+        self.close()
+        while self.stack:
+            self.parts.append(f"</{self.stack.pop()}>")
+        return "".join(self.parts)
+
+
+def to_xhtml(text):
+    return XhtmlWriter().convert(text)
+
+
+class HtmlExport:
+    """Carpeta con index.html y una página HTML por cada grupo de posts."""
+    XHTML = False
+
+    def __init__(self, output, title, pages):
+        self.output = output
+        self.title = title
+        self.pages = pages
+        self.index = []
+        os.makedirs(output, exist_ok=True)
+
+    def _nav(self, number):
+        links = []
+        if number > 1:
+            links.append(f'<a href="{page_name(number - 1)}.html">« Anterior</a>')
+        links.append('<a href="index.html">Índice</a>')
+        if number < self.pages:
+            links.append(f'<a href="{page_name(number + 1)}.html">Siguiente »</a>')
+        return f"<nav>{' · '.join(links)}</nav>\n"
+
+    def _write(self, name, title, body):
+        path = os.path.join(self.output, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('<!DOCTYPE html>\n<html lang="es">\n<head>\n'
+                    '<meta charset="utf-8">\n'
+                    f"<title>{html.escape(title)}</title>\n"
+                    f"<style>{PAGE_CSS}</style>\n</head>\n<body>\n")
+            f.writelines(body)
+            f.write("</body>\n</html>\n")
+
+    def write_page(self, number, posts):
+        title = f"{self.title} — página {number} de {self.pages}"
+        nav = self._nav(number)
+        body = [nav, f"<h1>{html.escape(title)}</h1>\n"]
+        body.extend(post_html(*post) for post in posts)
+        body.append(nav)
+        self._write(f"{page_name(number)}.html", title, body)
+        if posts:
+            post_id, username, post_date, _ = posts[0]
+            self.index.append((number, format_date(post_date), username))
+
+    def finish(self):
+        items = [f'<li><a href="{page_name(number)}.html">Página {number}</a>'
+                 f" — {date}, {html.escape(username)}</li>\n"
+                 for number, date, username in self.index]
+        self._write("index.html", self.title,
+                    [f"<h1>{html.escape(self.title)}</h1>\n<ol>\n", *items,
+                     "</ol>\n"])
+
+
+class EpubExport:
+    """Libro EPUB 3 con un capítulo por cada grupo de posts.
+
+    Los capítulos se escriben en el zip a medida que llegan; los posts
+    tienen que venir ya convertidos a XHTML.
+    """
+    XHTML = True
+
+    def __init__(self, output, title, pages):
+        self.output = output
+        self.title = title
+        self.pages = pages
+        self.chapters = []
+        self.zip = zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED)
+        # mimetype va primero y sin comprimir
+        self.zip.writestr("mimetype", "application/epub+zip",
+                          compress_type=zipfile.ZIP_STORED)
+        self.zip.writestr(
+            "META-INF/container.xml",
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<container version="1.0" '
+            'xmlns="urn:oasis:names:tc:opendocument:xmlns:container">\n'
+            '<rootfiles><rootfile full-path="OEBPS/content.opf" '
+            'media-type="application/oebps-package+xml"/></rootfiles>\n'
+            "</container>\n")
+        self.zip.writestr("OEBPS/style.css", PAGE_CSS)
+
+    XHTML_END = "</body>\n</html>\n"
+
+    def _xhtml_head(self, title):
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE html>\n'
+                '<html xmlns="http://www.w3.org/1999/xhtml" '
+                'xmlns:epub="http://www.idpf.org/2007/ops" lang="es">\n'
+                f"<head>\n<title>{html.escape(title)}</title>\n"
+                '<link rel="stylesheet" href="style.css" type="text/css"/>\n'
+                "</head>\n<body>\n")
+
+    def write_page(self, number, posts):
+        name = f"{page_name(number)}.xhtml"
+        title = f"Página {number}"
+        if posts:
+            title += f" — {format_date(posts[0][2])}"
+        with self.zip.open(f"OEBPS/{name}", "w") as f:
+            f.write((self._xhtml_head(title)
+                     + f"<h2>{html.escape(title)}</h2>\n").encode("utf-8"))
+            for post in posts:
+                f.write(post_html(*post).encode("utf-8"))
+            f.write(self.XHTML_END.encode("utf-8"))
+        self.chapters.append((name, title))
+
+    def finish(self):
+        items = "".join(f'<li><a href="{name}">{html.escape(title)}</a></li>\n'
+                        for name, title in self.chapters)
+        self.zip.writestr(
+            "OEBPS/nav.xhtml",
+            self._xhtml_head(self.title)
+            + f'<nav epub:type="toc" id="toc">\n'
+              f"<h1>{html.escape(self.title)}</h1>\n"
+              f"<ol>\n{items}</ol>\n</nav>\n" + self.XHTML_END)
+        manifest = "".join(
+            f'<item id="p{i}" href="{name}" '
+            'media-type="application/xhtml+xml"/>\n'
+            for i, (name, _) in enumerate(self.chapters))
+        spine = "".join(f'<itemref idref="p{i}"/>\n'
+                        for i in range(len(self.chapters)))
+        book_id = uuid.uuid5(uuid.NAMESPACE_URL,
+                             f"keaton:{os.path.basename(self.output)}")
+        modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        self.zip.writestr(
+            "OEBPS/content.opf",
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" '
+            'unique-identifier="book-id">\n'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+            f'<dc:identifier id="book-id">urn:uuid:{book_id}</dc:identifier>\n'
+            f"<dc:title>{html.escape(self.title)}</dc:title>\n"
+            "<dc:language>es</dc:language>\n"
+            f'<meta property="dcterms:modified">{modified}</meta>\n'
+            "</metadata>\n<manifest>\n"
+            '<item id="nav" href="nav.xhtml" '
+            'media-type="application/xhtml+xml" properties="nav"/>\n'
+            '<item id="css" href="style.css" media-type="text/css"/>\n'
+            f"{manifest}</manifest>\n<spine>\n{spine}</spine>\n</package>\n")
+        self.zip.close()
+
+
+def export_thread(json_file, output, executor=None,
+                  posts_per_page=POSTS_PER_PAGE, progress=None,
+                  cancelled=None):
+    """Exporta un hilo completo a `output`.
+
+    Si `output` termina en .epub se genera un EPUB; si no, una carpeta de
+    páginas HTML. El renderizado se reparte entre procesos y cada página se
+    escribe en cuanto está completa. `progress(hechos, total)` informa del
+    avance y `cancelled()` permite abandonar la exportación.
+    Devuelve el número de páginas escritas.
+    """
+    store = ThreadStore.open(json_file)
+    count = len(store)
+    store.close()
+    pages = max(1, math.ceil(count / posts_per_page))
+    export_class = (EpubExport if str(output).lower().endswith(".epub")
+                    else HtmlExport)
+    writer = export_class(str(output), thread_title(json_file), pages)
+
+    own_executor = executor is None
+    if own_executor:
+        executor = make_executor()
+    number = 0
+    try:
+        page = []
+        for done, post in enumerate(
+                rendered_posts(json_file, count, executor,
+                               xhtml=export_class.XHTML), 1):
+            if cancelled and cancelled():
+                break
+            page.append(post)
+            if len(page) == posts_per_page:
+                number += 1
+                writer.write_page(number, page)
+                page = []
+            if progress:
+                progress(done, count)
+        else:
+            if page or not count:
+                number += 1
+                writer.write_page(number, page)
+    finally:
+        writer.finish()
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
+    return number
@@ -0,0 +1,45 @@
+import threading
+
+from PySide6.QtCore import QObject, Signal
+
+from .export import export_thread
+
+PROGRESS_STEP = 25
+
+
+class ExportWorker(QObject):
+    """Exporta un hilo desde un hilo de Python e informa del avance."""
+    progress = Signal(int, int)
+    finished = Signal(str, int)
+    failed = Signal(str, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.running = False
+        self._cancelled = False
+
+    def export(self, json_file, output):
+        self.running = True
+        self._cancelled = False
+        threading.Thread(target=self._run, args=(json_file, output),
+                         daemon=True).start()
+
+    def _run(self, json_file, output):
+        try:
+            pages = export_thread(json_file, output,
+                                  progress=self._progress,
+                                  cancelled=lambda: self._cancelled)
+        except Exception as e:
+            self.running = False
+            self.failed.emit(output, str(e))
+            return
+        self.running = False
+        self.finished.emit(output, pages)
+
+    def _progress(self, done, total):
+        # una señal por lote basta para la barra de estado
+        if done % PROGRESS_STEP == 0 or done == total:
+            self.progress.emit(done, total)
+
+    def cancel(self):
+        self._cancelled = True
@@ -0,0 +1,502 @@
+"""Renderizador BBCode propio para las etiquetas de build_bbcode_parser.
+
+Genera exactamente el mismo HTML que bbcode.Parser con esos formatters, pero
+en una sola pasada: en vez de buscar hacia delante el cierre de cada etiqueta
+(y volver a recorrer su contenido al renderizarlo), mantiene una pila de
+etiquetas abiertas que se cierran con las mismas reglas que usa bbcode.
+
+tests/test_fast_bbcode.py compara ambos renderizadores con todos los posts
+de threads/ (`compare_with_reference`).
+"""
+import functools
+import hashlib
+import os
+import re
+
+from .bbcode_parser import (COLOR_MAP, FORMATTERS, PARSER_VERSION,
+                            get_parser, simple_formatter)
+from .roll_store import ROLLS_FILE
+
+START, END, DATA = 1, 2, 4
+
+NEWLINE = "<br />"
+URL_TEMPLATE = '<a rel="nofollow" href="{href}">{text}</a>'
+
+# Las mismas expresiones y sustituciones que bbcode
+URL_RE = re.compile(
+    r"(?im)\b((?:https?://|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,4}/)"
+    r'(?:[^\s()<>]+|\([^\s()<>]+\))+(?:\([^\s()<>]+\)|[^\s`!()\[\]{};:\'".,<>?]))'
+)
+REPLACE_ESCAPE = (
+    ("&", "&amp;"),
+    ("<", "&lt;"),
+    (">", "&gt;"),
+    ('"', "&quot;"),
+    ("'", "&#39;"),
+)
+REPLACE_COSMETIC = (
+    ("---", "&mdash;"),
+    ("--", "&ndash;"),
+    ("...", "&#8230;"),
+    ("(c)", "&copy;"),
+    ("(reg)", "&reg;"),
+    ("(tm)", "&trade;"),
+)
+
+_renderer_version = None
+
+
+def _replacer(replacements):
+    """Aplica las sustituciones en una sola pasada.
+
+    Ninguna sustitución crea texto que otra vuelva a cambiar, así que el
+    resultado es el mismo que encadenando str.replace en ese orden.
+    """
+    table = dict(replacements)
+    pattern = re.compile("|".join(re.escape(find)
+                                  for find, repl in replacements))
+    return lambda data: pattern.sub(lambda match: table[match.group()], data)
+
+
+# (escape_html, replace_cosmetic) → sustitución
+REPLACERS = {
+    (True, True): _replacer(REPLACE_ESCAPE + REPLACE_COSMETIC),
+    (True, False): _replacer(REPLACE_ESCAPE),
+    (False, True): _replacer(REPLACE_COSMETIC),
+}
+
+
+class TagSpec:
+    """Opciones de una etiqueta; mismos valores por defecto que TagOptions."""
+    __slots__ = ("tag_name", "render", "newline_closes", "same_tag_closes",
+                 "standalone", "render_embedded", "transform_newlines",
+                 "escape_html", "replace_links", "replace_cosmetic", "strip",
+                 "swallow_trailing_newline", "flags")
+
+    def __init__(self, tag_name, render, newline_closes=False,
+                 same_tag_closes=False, standalone=False,
+                 render_embedded=True, transform_newlines=True,
+                 escape_html=True, replace_links=True, replace_cosmetic=True,
+                 strip=False, swallow_trailing_newline=False):
+        self.tag_name = tag_name
+        self.render = render
+        self.newline_closes = newline_closes
+        self.same_tag_closes = same_tag_closes
+        self.standalone = standalone
+        self.render_embedded = render_embedded
+        self.transform_newlines = transform_newlines
+        self.escape_html = escape_html
+        self.replace_links = replace_links
+        self.replace_cosmetic = replace_cosmetic
+        self.strip = strip
+        self.swallow_trailing_newline = swallow_trailing_newline
+        self.flags = (escape_html, replace_links, replace_cosmetic,
+                      transform_newlines)
+
+
+def _render_list(tag_name, value, options, parent, context):
+    list_type = options["list"] if (options and "list" in options) else "*"
+    css_opts = {
+        "1": "decimal",
+        "01": "decimal-leading-zero",
+        "a": "lower-alpha",
+        "A": "upper-alpha",
+        "i": "lower-roman",
+        "I": "upper-roman",
+    }
+    tag = "ol" if list_type in css_opts else "ul"
+    css = (' style="list-style-type:%s;"' % css_opts[list_type]
+           if list_type in css_opts else "")
+    return "<%s%s>%s</%s>" % (tag, css, value, tag)
+
+
+def _render_list_item(tag_name, value, options, parent, context):
+    if not parent or parent.tag_name != "list":
+        return "[*]%s<br />" % value
+    return "<li>%s</li>" % value
+
+
+# Formatters por defecto de bbcode.Parser que FORMATTERS no sustituye
+DEFAULT_FORMATTERS = [
+    ("s", simple_formatter("<strike>%(value)s</strike>"), {}),
+    ("sub", simple_formatter("<sub>%(value)s</sub>"), {}),
+    ("sup", simple_formatter("<sup>%(value)s</sup>"), {}),
+    ("list", _render_list, {"transform_newlines": False, "strip": True,
+                            "swallow_trailing_newline": True}),
+    ("*", _render_list_item, {"newline_closes": True,
+                              "transform_newlines": False,
+                              "same_tag_closes": True, "strip": True}),
+    ("code", simple_formatter("<code>%(value)s</code>"),
+     {"render_embedded": False, "transform_newlines": False,
+      "swallow_trailing_newline": True, "replace_cosmetic": False}),
+    ("center",
+     simple_formatter('<div style="text-align:center;">%(value)s</div>'), {}),
+]
+
+TAGS = {tag_name: TagSpec(tag_name, render_func, **options)
+        for tag_name, render_func, options in DEFAULT_FORMATTERS + FORMATTERS}
+
+# Texto fuera de cualquier etiqueta
+ROOT_FLAGS = (True, True, True, True)
+
+
+def _link_replace(match):
+    url = match.group(0)
+    href = url
+    if "://" not in href:
+        href = "http://" + href
+    return URL_TEMPLATE.format(href=href.replace('"', "%22"), text=url)
+
+
+def transform(data, escape_html, replace_links, replace_cosmetic,
+              transform_newlines):
+    url_matches = {}
+    # Toda URL reconocible contiene "/" o empieza por www
+    if replace_links and ("/" in data or "www" in data.lower()):
+        pos = 0
+        while True:
+            match = URL_RE.search(data, pos)
+            if not match:
+                break
+            token = "{{ bbcode-link-%s }}" % len(url_matches)
+            url_matches[token] = _link_replace(match)
+            start, end = match.span()
+            data = data[:start] + token + data[end:]
+            pos = start
+    if escape_html or replace_cosmetic:
+        data = REPLACERS[escape_html, replace_cosmetic](data)
+    for token, replacement in url_matches.items():
+        data = data.replace(token, replacement)
+    if transform_newlines:
+        data = data.replace("\n", "\r")
+    return data
+
+
+def _tag_extent(data, start):
+    """Fin de la etiqueta que empieza en `start`: (posición, cerrada)."""
+    opener = data.find("[", start + 1)
+    closer = data.find("]", start + 1)
+    closed = closer >= 0 and (opener < 0 or closer < opener)
+    stop = closer if closed else (opener if opener >= 0 else len(data))
+    segment = data[start + 1:stop]
+    if "=" not in segment or ('"' not in segment and "'" not in segment):
+        return (closer + 1, True) if closed else (stop, False)
+
+    # Hay comillas tras un "=": los corchetes entre comillas no cuentan
+    in_quote = False
+    quotable = False
+    for i in range(start + 1, len(data)):
+        ch = data[i]
+        if ch == "=":
+            quotable = True
+        if ch in ('"', "'"):
+            if quotable and not in_quote:
+                in_quote = ch
+            elif in_quote == ch:
+                in_quote = False
+                quotable = False
+        if not in_quote and ch == "[":
+            return i, False
+        if not in_quote and ch == "]":
+            return i + 1, True
+    return len(data), False
+
+
+def _parse_opts(data):
+    """Nombre y opciones de una etiqueta como `quote="autor"` o `url=x`."""
+    name = None
+    opts = {}
+    in_value = False
+    in_quote = False
+    attr = ""
+    value = ""
+    attr_done = False
+    stripped = data.strip()
+    ls = len(stripped)
+    pos = 0
+
+    while pos < ls:
+        ch = stripped[pos]
+        if in_value:
+            if in_quote:
+                if (ch == "\\" and ls > pos + 1
+                        and stripped[pos + 1] in ("\\", '"', "'")):
+                    value += stripped[pos + 1]
+                    pos += 1
+                elif ch == in_quote:
+                    in_quote = False
+                    in_value = False
+                    if attr:
+                        opts[attr.lower()] = value.strip()
+                    attr = ""
+                    value = ""
+                else:
+                    value += ch
+            else:
+                if ch in ('"', "'"):
+                    in_quote = ch
+                elif ch == " " and data.find("=", pos + 1) > 0:
+                    opts[attr.lower()] = value.strip()
+                    attr = ""
+                    value = ""
+                    in_value = False
+                else:
+                    value += ch
+        else:
+            if ch == "=":
+                in_value = True
+                if name is None:
+                    name = attr
+            elif ch == " ":
+                attr_done = True
+            else:
+                if attr_done:
+                    if attr:
+                        if name is None:
+                            name = attr
+                        else:
+                            opts[attr.lower()] = ""
+                    attr = ""
+                    attr_done = False
+                attr += ch
+        pos += 1
+
+    if attr:
+        if name is None:
+            name = attr
+        opts[attr.lower()] = value.strip()
+    return name.lower(), opts
+
+
+@functools.lru_cache(maxsize=4096)
+def _tag_token(tag):
+    """Token de un texto entre corchetes; si no es una etiqueta, texto.
+
+    Las mismas etiquetas se repiten mucho, así que se guardan ya analizadas;
+    ningún formatter modifica el diccionario de opciones.
+    """
+    tag_name = tag[1:-1].strip()
+    if not tag_name or "\n" in tag:
+        return DATA, None, None, tag
+    closer = tag_name[0] == "/"
+    options = None
+    if closer:
+        tag_name = tag_name[1:]
+    elif "=" in tag_name or " " in tag_name:
+        tag_name, options = _parse_opts(tag_name)
+    else:
+        options = {}
+    tag_name = tag_name.strip().lower()
+    if tag_name not in TAGS:
+        return DATA, None, None, tag
+    return (END if closer else START), tag_name, options, tag
+
+
+def tokenize(data):
+    """Divide el mensaje en etiquetas y texto.
+
+    A diferencia de bbcode los saltos de línea quedan dentro del texto; el
+    renderizador sólo los separa cuando alguna etiqueta abierta depende de
+    ellos.
+    """
+    data = data.replace("\r\n", "\n").replace("\r", "\n")
+    tokens = []
+    append = tokens.append
+    pos = 0
+    while True:
+        start = data.find("[", pos)
+        if start < 0:
+            break
+        if start > pos:
+            append((DATA, None, None, data[pos:start]))
+        end, found_close = _tag_extent(data, start)
+        if found_close:
+            append(_tag_token(data[start:end]))
+        else:
+            append((DATA, None, None, data[start:end]))
+        pos = end
+    if pos < len(data):
+        append((DATA, None, None, data[pos:]))
+    return tokens
+
+
+class _Frame:
+    __slots__ = ("spec", "options", "parts", "embed_count", "block_count")
+
+    def __init__(self, spec, options):
+        self.spec = spec
+        self.options = options
+        self.parts = []
+        self.embed_count = 0
+        self.block_count = 0
+
+
+class _Renderer:
+    """Pila de etiquetas abiertas de un mensaje.
+
+    bbcode delimita cada etiqueta buscando su cierre entre los tokens de la
+    etiqueta que la contiene, así que un token cierra la etiqueta abierta más
+    externa que termine en él y, con ella, todas las que tenga dentro.
+    """
+
+    def __init__(self):
+        self.stack = [_Frame(None, None)]
+        self.context = {}
+        # etiquetas abiertas que se cierran con un salto de línea
+        self.newline_frames = 0
+        # la última etiqueta cerrada se traga el salto de línea siguiente
+        self.swallow = False
+
+    def close(self, index):
+        """Cierra las etiquetas desde `index` hasta la cima de la pila."""
+        stack = self.stack
+        spec = None
+        while len(stack) > index:
+            frame = stack.pop()
+            spec = frame.spec
+            if spec.newline_closes:
+                self.newline_frames -= 1
+            if spec.render_embedded:
+                inner = "".join(frame.parts)
+            else:
+                inner = transform("".join(frame.parts), *spec.flags)
+            if spec.strip:
+                inner = inner.strip()
+            parent = stack[-1]
+            parent.parts.append(spec.render(spec.tag_name, inner,
+                                            frame.options, parent.spec,
+                                            self.context))
+        return spec
+
+    def text(self, data):
+        frame = self.stack[-1]
+        spec = frame.spec
+        if spec is not None and not spec.render_embedded:
+            frame.parts.append(data)
+            return
+        flags = ROOT_FLAGS if spec is None else spec.flags
+        if "\n" in data and "{{ bbcode-link-" in data:
+            # bbcode transforma cada línea por separado; sólo se nota si el
+            # texto ya trae algo con forma de marcador de enlace
+            newline = "\r" if flags[3] else "\n"
+            frame.parts.append(newline.join(
+                transform(line, *flags) for line in data.split("\n")))
+        else:
+            frame.parts.append(transform(data, *flags))
+
+    def newline(self):
+        stack = self.stack
+        if self.newline_frames:
+            for index in range(1, len(stack)):
+                frame = stack[index]
+                if frame.spec.newline_closes and frame.block_count == 0:
+                    spec = self.close(index)
+                    self.swallow = spec.swallow_trailing_newline
+                    return
+        if self.swallow:
+            self.swallow = False
+        else:
+            self.text("\n")
+
+    def feed_data(self, data):
+        if not (self.newline_frames or self.swallow) or "\n" not in data:
+            self.swallow = False
+            self.text(data)
+            return
+        pos = 0
+        while True:
+            nl = data.find("\n", pos)
+            if nl < 0:
+                if pos < len(data):
+                    self.swallow = False
+                    self.text(data[pos:])
+                return
+            if nl > pos:
+                self.swallow = False
+                self.text(data[pos:nl])
+            self.newline()
+            pos = nl + 1
+
+    def feed_tag(self, kind, tag_name, options, text):
+        self.swallow = False
+        stack = self.stack
+        tag = TAGS[tag_name]
+        block = self.newline_frames and not tag.transform_newlines
+        for index in range(1, len(stack)):
+            frame = stack[index]
+            spec = frame.spec
+            if block and spec.newline_closes:
+                frame.block_count += 1 if kind == START else -1
+            if tag_name != spec.tag_name:
+                continue
+            if kind == START:
+                if spec.same_tag_closes:
+                    # se cierra sin consumir la etiqueta, que se abre después
+                    self.close(index)
+                    break
+                if spec.render_embedded:
+                    frame.embed_count += 1
+            elif frame.embed_count:
+                frame.embed_count -= 1
+            else:
+                self.swallow = self.close(index).swallow_trailing_newline
+                return
+
+        top = stack[-1]
+        if top.spec is not None and not top.spec.render_embedded:
+            top.parts.append(text)
+        elif kind == END:
+            # cierre suelto: bbcode lo descarta
+            return
+        elif tag.standalone:
+            top.parts.append(tag.render(tag_name, None, options, top.spec,
+                                        self.context))
+        else:
+            stack.append(_Frame(tag, options))
+            if tag.newline_closes:
+                self.newline_frames += 1
+
+    def finish(self):
+        self.close(1)
+        return "".join(self.stack[0].parts).replace("\r", NEWLINE)
+
+
+def render_message(message):
+    """HTML de un mensaje, idéntico al de bbcode_parser.render_message."""
+    renderer = _Renderer()
+    for kind, tag_name, options, text in tokenize(message):
+        if kind == DATA:
+            renderer.feed_data(text)
+        else:
+            renderer.feed_tag(kind, tag_name, options, text)
+    return renderer.finish()
+
+
+def renderer_version():
+    """Huella de todo lo que influye en el HTML generado.
+
+    Cambia con PARSER_VERSION, con COLOR_MAP y con el archivo de tiradas que
+    usa [dice]. El código no entra: la versión compilada no lleva los
+    fuentes, así que cualquier cambio en el HTML debe subir PARSER_VERSION.
+    """
+    global _renderer_version
+    if _renderer_version is None:
+        digest = hashlib.blake2b(str(PARSER_VERSION).encode(), digest_size=16)
+        digest.update(repr(sorted(COLOR_MAP.items())).encode())
+        try:
+            stat = os.stat(ROLLS_FILE)
+            digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+        except OSError:
+            pass
+        _renderer_version = digest.hexdigest()
+    return _renderer_version
+
+
+def compare_with_reference(messages):
+    """Genera (índice, esperado, obtenido) por cada mensaje que difiera."""
+    parser = get_parser()
+    for index, message in enumerate(messages):
+        expected = parser.format(message)
+        got = render_message(message)
+        if got != expected:
+            yield index, expected, got
@@ -0,0 +1,87 @@
+import os
+from concurrent.futures import as_completed
+
+from .process_pool import make_executor
+from .query import parse_query
+from .search import SearchEngine
+from .thread_store import ThreadStore
+
+MAX_HITS_PER_THREAD = 500
+SNIPPET_WIDTH = 60
+
+
+def thread_files(threads_dir):
+    """Archivos de hilos de la carpeta, ordenados por su id."""
+    files = [f for f in os.listdir(threads_dir)
+             if f.endswith(".json") and "#" in f]
+    return sorted(files, key=lambda f: int(f.split("#")[0]))
+
+
+def make_snippet(message, message_norm, query_norm, width=SNIPPET_WIDTH):
+    pos = message_norm.find(query_norm)
+    if pos < 0:
+        pos = 0
+    # Si la normalización no cambió la longitud, se muestra el texto original
+    text = message if len(message) == len(message_norm) else message_norm
+    start = max(0, pos - width)
+    end = pos + len(query_norm) + width
+    snippet = text[start:end].replace("\n", " ").strip()
+    if start > 0:
+        snippet = "..." + snippet
+    if end < len(text):
+        snippet += "..."
+    return snippet
+
+
+def search_thread(json_file, query, limit=MAX_HITS_PER_THREAD):
+    """Busca en un hilo; devuelve (archivo, total, [(post_id, fragmento)]).
+
+    El almacén se cierra al terminar: si siguiera abierto en el proceso de
+    trabajo, en Windows la interfaz no podría sustituirlo al reconstruirlo.
+    """
+    store = ThreadStore.open(json_file)
+    try:
+        engine = SearchEngine.open(json_file, store)
+        terms = parse_query(query).terms
+        rows = engine.search_all(query)
+        hits = []
+        for row in rows[:limit]:
+            post = store[row]
+            hits.append((post["post_id"],
+                         make_snippet(post["message"], post["message_norm"],
+                                      terms[0] if terms else "")))
+    finally:
+        store.close()
+    return json_file, len(rows), hits
+
+
+def search_threads(threads_dir, query, executor=None, cancelled=None,
+                   on_error=None):
+    """Busca en todos los hilos en paralelo.
+
+    Genera (archivo, total, hits) por cada hilo a medida que terminan. Un
+    hilo que no se puede leer se salta y se avisa con
+    `on_error(archivo, mensaje)`.
+    """
+    own_executor = executor is None
+    if own_executor:
+        executor = make_executor()
+    try:
+        futures = {executor.submit(search_thread,
+                                   os.path.join(threads_dir, f), query): f
+                   for f in thread_files(threads_dir)}
+        for future in as_completed(futures):
+            if cancelled and cancelled():
+                for pending in futures:
+                    pending.cancel()
+                return
+            try:
+                json_file, total, hits = future.result()
+            except Exception as e:
+                if on_error is not None:
+                    on_error(futures[future], str(e))
+                continue
+            yield os.path.basename(json_file), total, hits
+    finally:
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
@@ -0,0 +1,157 @@
+import threading
+from pathlib import Path
+
+from PySide6.QtCore import QObject, Qt, QTimer, Signal
+from PySide6.QtWidgets import (QDialog, QLabel, QLineEdit, QTreeWidget,
+                               QTreeWidgetItem, QVBoxLayout)
+
+from .global_search import search_threads
+from .process_pool import make_executor
+
+
+class GlobalSearchWorker(QObject):
+    """Lanza búsquedas en todos los hilos desde un hilo de Python.
+
+    Los resultados de cada hilo llegan por señal en cuanto están listos;
+    una búsqueda nueva deja obsoleta a la anterior. Los hilos que no se
+    pueden leer llegan por `thread_failed`, y `finished` llega siempre.
+    """
+    thread_results = Signal(int, str, int, list)
+    thread_failed = Signal(int, str, str)
+    finished = Signal(int)
+
+    def __init__(self, threads_dir, parent=None):
+        super().__init__(parent)
+        self.threads_dir = threads_dir
+        self.generation = 0
+        self._executor = None
+
+    def search(self, query):
+        self.generation += 1
+        if self._executor is None:
+            self._executor = make_executor()
+        threading.Thread(target=self._run, args=(query, self.generation),
+                         daemon=True).start()
+        return self.generation
+
+    def _run(self, query, generation):
+        def cancelled():
+            return generation != self.generation
+
+        def on_error(filename, error):
+            self.thread_failed.emit(generation, filename, error)
+
+        try:
+            for filename, total, hits in search_threads(
+                    self.threads_dir, query, self._executor, cancelled,
+                    on_error):
+                self.thread_results.emit(generation, filename, total, hits)
+        except Exception as e:
+            on_error(self.threads_dir, str(e))
+        finally:
+            if not cancelled():
+                self.finished.emit(generation)
+
+    def cancel(self):
+        self.generation += 1
+
+    def shutdown(self):
+        self.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class GlobalSearchDialog(QDialog):
+    post_selected = Signal(str, int)
+
+    def __init__(self, threads_dir, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Buscar en todos los juegos")
+        self.resize(700, 500)
+        self.total_hits = 0
+        self.failed = []
+
+        self.search_box = QLineEdit()
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.setPlaceholderText("Buscar en todos los juegos...")
+        self.results = QTreeWidget()
+        self.results.setHeaderLabels(["Post", "Fragmento"])
+        self.results.setColumnWidth(0, 220)
+        self.status = QLabel("")
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.search_box)
+        layout.addWidget(self.results)
+        layout.addWidget(self.status)
+
+        self.worker = GlobalSearchWorker(threads_dir, self)
+        self.worker.thread_results.connect(self.add_thread_results)
+        self.worker.thread_failed.connect(self.add_failed_thread)
+        self.worker.finished.connect(self.search_finished)
+
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.timeout.connect(self.search)
+        self.search_box.textEdited.connect(
+            lambda: self.search_timer.start(300))
+        self.search_box.returnPressed.connect(self.search)
+        self.results.itemClicked.connect(self.open_item)
+
+    def search(self):
+        self.search_timer.stop()
+        self.results.clear()
+        self.total_hits = 0
+        self.failed = []
+        query = self.search_box.text().strip()
+        if not query:
+            self.worker.cancel()
+            self.status.setText("")
+            return
+        self.status.setText("Buscando...")
+        self.worker.search(query)
+
+    def add_thread_results(self, generation, filename, total, hits):
+        if generation != self.worker.generation or not total:
+            return
+        self.total_hits += total
+        id_, name = filename.split("#")
+        shown = f"{total}" if total == len(hits) else f"{len(hits)} de {total}"
+        thread_item = QTreeWidgetItem([f"{Path(name).stem} ({shown})"])
+        thread_item.setData(0, Qt.UserRole + 1, int(id_))
+        for post_id, snippet in hits:
+            item = QTreeWidgetItem([f"#{post_id}", snippet])
+            item.setData(0, Qt.UserRole, (filename, post_id))
+            item.setToolTip(1, snippet)
+            thread_item.addChild(item)
+        # Los hilos llegan en cualquier orden; se insertan ordenados por id
+        position = 0
+        while (position < self.results.topLevelItemCount()
+               and self.results.topLevelItem(position).data(
+                    0, Qt.UserRole + 1) < int(id_)):
+            position += 1
+        self.results.insertTopLevelItem(position, thread_item)
+
+    def add_failed_thread(self, generation, filename, error):
+        if generation != self.worker.generation:
+            return
+        self.failed.append(f"{filename}: {error}")
+
+    def search_finished(self, generation):
+        if generation != self.worker.generation:
+            return
+        games = self.results.topLevelItemCount()
+        text = f"{self.total_hits} resultados en {games} juegos"
+        if self.failed:
+            text += f" ({len(self.failed)} no se pudieron leer)"
+        self.status.setText(text)
+        self.status.setToolTip("\n".join(self.failed))
+
+    def open_item(self, item):
+        data = item.data(0, Qt.UserRole)
+        if data:
+            filename, post_id = data
+            self.post_selected.emit(filename, post_id)
+
+    def shutdown(self):
+        self.worker.shutdown()
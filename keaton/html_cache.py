@@ -0,0 +1,70 @@
+import hashlib
+import sqlite3
+import threading
+
+from .fast_bbcode import renderer_version
+
+HTML_CACHE_SUFFIX = ".html.sqlite"
+
+
+class HtmlStore:
+    """HTML renderizado de un hilo, guardado en disco junto al json.
+
+    Las claves son un hash del mensaje y de la versión del renderizador; si
+    la versión cambia, el contenido anterior se descarta al abrir.
+    """
+
+    def __init__(self, json_file):
+        self.path = json_file + HTML_CACHE_SUFFIX
+        self.version = renderer_version()
+        self._lock = threading.Lock()
+        try:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta "
+                             "(name TEXT PRIMARY KEY, value TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS rendered "
+                             "(key BLOB PRIMARY KEY, html TEXT NOT NULL)")
+            row = self._db.execute(
+                "SELECT value FROM meta WHERE name = 'version'").fetchone()
+            if row is None or row[0] != self.version:
+                self._db.execute("DELETE FROM rendered")
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES "
+                                 "('version', ?)", (self.version,))
+            self._db.commit()
+        except sqlite3.Error:
+            self._db = None
+
+    def key(self, message):
+        digest = hashlib.blake2b(self.version.encode(), digest_size=16)
+        digest.update(message.encode("utf-8"))
+        return digest.digest()
+
+    def get(self, message):
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT html FROM rendered WHERE key = ?",
+                                   (self.key(message),)).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, items):
+        """items: lista de (message, html)."""
+        if self._db is None or not items:
+            return
+        with self._lock:
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO rendered VALUES (?, ?)",
+                    [(self.key(message), html) for message, html in items])
+                self._db.commit()
+            except sqlite3.Error:
+                pass
+
+    def put(self, message, html):
+        self.put_many([(message, html)])
+
+    def close(self):
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+            self._db = None
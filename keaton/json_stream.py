@@ -0,0 +1,79 @@
+import codecs
+import json
+import re
+
+# Bytes que se leen del archivo cada vez
+CHUNK_SIZE = 1 << 16
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+_START, _FIRST, _VALUE, _SEPARATOR = range(4)
+
+
+class JsonArrayReader:
+    """Lee un array JSON de un archivo elemento a elemento.
+
+    Sólo se guarda en memoria el trozo del archivo que se está decodificando,
+    no el documento entero. `position` cuenta los bytes leídos hasta ahora.
+    """
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.position = 0
+
+    def __iter__(self):
+        decode = json.JSONDecoder().raw_decode
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        self.position = 0
+        with open(self.path, "rb") as f:
+            buf = ""
+            pos = 0
+            eof = False
+            state = _START
+            while True:
+                pos = WHITESPACE.match(buf, pos).end()
+                if pos < len(buf):
+                    char = buf[pos]
+                    if state == _START:
+                        if char != "[":
+                            raise self._error("se esperaba '['", buf, pos)
+                        pos += 1
+                        state = _FIRST
+                        continue
+                    if char == "]" and state in (_FIRST, _SEPARATOR):
+                        return
+                    if state == _SEPARATOR:
+                        if char != ",":
+                            raise self._error("se esperaba ',' o ']'",
+                                              buf, pos)
+                        pos += 1
+                        state = _VALUE
+                        continue
+                    try:
+                        value, end = decode(buf, pos)
+                    except json.JSONDecodeError:
+                        if eof:
+                            raise
+                    else:
+                        # un objeto, un array o una cadena ya están completos;
+                        # un número o un literal sólo si lo sigue un separador
+                        after = WHITESPACE.match(buf, end).end()
+                        if (eof or char in '{["'
+                                or (after < len(buf) and buf[after] in ",]")):
+                            yield value
+                            pos = end
+                            state = _SEPARATOR
+                            continue
+                if eof:
+                    raise self._error("el array no está cerrado", buf, pos)
+                # el elemento no cabe en lo leído: se lee al menos otro tanto
+                chunk = f.read(max(self.chunk_size, len(buf) - pos))
+                self.position += len(chunk)
+                eof = not chunk
+                buf = buf[pos:] + decoder.decode(chunk, final=eof)
+                pos = 0
+
+    def _error(self, message, buf, pos):
+        return json.JSONDecodeError(f"{self.path}: {message}", buf, pos)
+
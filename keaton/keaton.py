@@ -1,24 +1,35 @@
-import json
 import os
-import re
 from pathlib import Path
 
 from PySide6.QtCore import Qt, QTimer, QRegularExpression, QSize
-from PySide6.QtGui import (QAction, QIcon, QStandardItemModel, QStandardItem,
+from PySide6.QtGui import (QAction, QIcon,
                            QDesktopServices, QShortcut, QKeySequence,
                            QTextCursor,
                            QTextCharFormat, QColor)
 from PySide6.QtWidgets import (
     QMainWindow, QSplitter, QListView, QWidget, QVBoxLayout, QLineEdit,
     QHBoxLayout, QTextBrowser, QPushButton, QLabel, QTextEdit,
-    QProgressBar, QMenu, QToolButton, QSizePolicy
+    QProgressBar, QMenu, QToolButton, QSizePolicy, QFileDialog, QMessageBox
 )
 
-from .bbcode_parser import build_bbcode_parser
-from .mensaje_preview import MensajePreview
+from .export_worker import ExportWorker
+from .global_search_dialog import GlobalSearchDialog
+from .html_cache import HtmlStore
+from .load_worker import LoadWorker
+from .mensaje_preview import ROW_CACHE_SIZE, MensajePreview
+from .message_model import MessageListModel
+from .query import parse_query
+from .render_cache import RenderCache
+from .render_worker import PrerenderWorker
+from .search_worker import SearchWorker
+from .settings_store import get_settings
+from .thread_store import ThreadStore
 from ui import keaton_rc
-from .utils import (format_date, load_settings, save_setting,
-                    accent_insensitive_regex, strip_accents)
+from .utils import load_settings, save_setting, accent_insensitive_regex
+
+
+# Posts que se renderizan por adelantado a cada lado del actual
+PRERENDER_NEIGHBORS = 3
 
 
 class Keaton(QMainWindow):
@@ -44,16 +55,43 @@ class Keaton(QMainWindow):
         self.status.addPermanentWidget(self.progress_label)
         settings = load_settings()
         self.boton_games = QToolButton()
+        self.boton_buscar_todos = QToolButton()
+        self.global_search = None
+        self.boton_exportar = QToolButton()
+        self.export_worker = ExportWorker(self)
+        self.export_worker.progress.connect(self.on_export_progress)
+        self.export_worker.finished.connect(self.on_export_finished)
+        self.export_worker.failed.connect(self.on_export_failed)
         self.boton_temas = QToolButton()
         self.boton_temas.setIconSize(QSize(30, 30))
+        self.preview_delegate = MensajePreview(
+            self, settings.get("row_cache_size", ROW_CACHE_SIZE))
         self.change_theme(f"{settings.get('theme')}.qss")
         self.change_theme(f"{settings.get('theme')}.qss")
         self.resize(1200, 700)
         self.thread_id = 0
+        self.json_file = None
         self.data = []
+        self.search_engine = None
         self.total_len = 0
-
-        self.filtered = []
+        self.loading = False
+        # post que se mostrará en cuanto llegue durante la carga; 0 indica
+        # el primero del hilo y None que ya no hay nada pendiente
+        self.pending_post_id = None
+        self.load_worker = LoadWorker(self)
+        self.load_worker.posts_loaded.connect(self.on_posts_loaded)
+        self.load_worker.progress.connect(self.on_load_progress)
+        self.load_worker.store_ready.connect(self.on_store_ready)
+        self.load_worker.engine_ready.connect(self.on_engine_ready)
+        self.load_worker.failed.connect(self.on_load_failed)
+
+        self.message_model = MessageListModel(self)
+        self.render_cache = RenderCache()
+        self.prerender_worker = PrerenderWorker(self.render_cache, self)
+        self.search_pending = False
+        self.search_worker = SearchWorker(self)
+        self.search_worker.results_ready.connect(self.on_search_results)
+        self.search_worker.finished.connect(self.on_search_finished)
         self.search_timer = QTimer(self)
         self.search_timer.setSingleShot(True)
         self.search_timer.timeout.connect(self.search_messages)
@@ -63,7 +101,10 @@ class Keaton(QMainWindow):
         self.barra_de_herramientas = QWidget()
         self.load_menus()
         self.message_list = QListView()
+        self.message_list.setModel(self.message_model)
+        self.message_list.setItemDelegate(self.preview_delegate)
         self.search_box = QLineEdit()
+        self.search_count = QLabel("")
 
         self.current_post_id = 0
         self.matches = []
@@ -115,10 +156,14 @@ class Keaton(QMainWindow):
         search_layout = QHBoxLayout()
         self.search_box.setClearButtonEnabled(True)
         self.search_box.setPlaceholderText("Buscar en los mensajes...")
+        self.search_box.setToolTip(
+            'Filtros: user:nombre, after:AAAA-MM-DD, before:AAAA-MM-DD, '
+            'badge:actualizacion, badge:miniactualizacion, "frase exacta"')
         self.search_box.textEdited.connect(self.search_with_delay)
         self.search_box.returnPressed.connect(self.search_messages)
         # self.search_box.signal_cleared.connect(self.search_messages)
         search_layout.addWidget(self.search_box)
+        search_layout.addWidget(self.search_count)
 
         self.barra_de_herramientas.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
         layout.addWidget(self.barra_de_herramientas)
@@ -129,33 +174,38 @@ class Keaton(QMainWindow):
         # Conexiones
         self.message_list.clicked.connect(self.show_message)
 
-    def load_messages(self, query=None):
-        model = QStandardItemModel()
-        self.filtered = []
-        for msg in self.data:
-            text = msg["message_norm"]
-            if query:
-                query_norm = strip_accents(query.lower())
-                username = (msg["username_norm"])
-                if query_norm not in f"{text}{username}":
-                    continue
-            preview = re.sub(r"\[.*?]", "", text)  # quita tags BBCode
-            preview = preview.strip().replace("\n", " ")[:280] + "..."
-            item = QStandardItem()
-            item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-            item.setData({
-                "post_id": msg["post_id"],
-                "username": msg["username"],
-                "date": format_date(msg["post_date"]),
-                "preview": preview,
-                "message": msg["message"]
-            }, Qt.UserRole)
-            model.appendRow(item)
-            self.filtered.append(msg)
-        self.message_list.setModel(model)
-        self.message_list.setItemDelegate(MensajePreview())
+    def load_messages(self):
+        """Muestra todos los posts; las búsquedas van por SearchWorker."""
+        self.message_model.set_rows(range(len(self.data)))
+        self.finish_search()
+
+    def on_search_results(self, generation, rows):
+        if generation != self.search_worker.generation:
+            return
+        # El primer lote reemplaza la lista; los siguientes se añaden
+        if self.search_pending:
+            self.search_pending = False
+            self.message_model.set_rows(rows)
+        else:
+            self.message_model.append_rows(rows)
+        self.update_search_count()
+
+    def on_search_finished(self, generation):
+        if generation != self.search_worker.generation:
+            return
+        if self.search_pending:
+            self.search_pending = False
+            self.message_model.set_rows([])
+        self.finish_search()
+
+    def update_search_count(self):
+        self.search_count.setText(
+            f"{self.message_model.rowCount()} / {len(self.data)}")
+
+    def finish_search(self):
+        self.update_search_count()
         self.select_index_by_post_id(self.current_post_id)
-        if len(self.filtered) > 0:
+        if self.message_model.rowCount() > 0:
             self.search_box.setStyleSheet("")
         else:
             self.search_box.setStyleSheet("background-color: #eb4d4b;")
@@ -163,35 +213,41 @@ class Keaton(QMainWindow):
     def show_message(self, index):
         self.current_post_id = index.data(Qt.UserRole).get("post_id")
         save_setting(f"current_post_id_{self.thread_id}", self.current_post_id)
-        msg = self.filtered[index.row()]
-        parser = build_bbcode_parser()
-        html = parser.format(msg.get("message"))
+        msg = self.message_model.post(index.row())
+        html = self.render_cache.render(msg.get("post_id"), msg.get("message"))
         self.message_view.setHtml(html)
         self.highlight_all()
         self.actualizar_barra_de_estado(index)
+        self.prerender_neighbors(index.row())
+
+    def prerender_neighbors(self, row):
+        posts = []
+        for offset in range(1, PRERENDER_NEIGHBORS + 1):
+            for neighbor in (row + offset, row - offset):
+                if not 0 <= neighbor < self.message_model.rowCount():
+                    continue
+                msg = self.message_model.post(neighbor)
+                if msg["post_id"] not in self.render_cache:
+                    posts.append((msg["post_id"], msg["message"]))
+        self.prerender_worker.prerender(posts)
 
     def actualizar_barra_de_estado(self, index):
-        current_pos = next((i for i, msg in enumerate(self.data) if msg.get("post_id") == self.current_post_id), -1)
-        accumulated_len = sum(
-            len(self.data[i]["message_norm"]) for i in range(current_pos + 1))
-        percentage = (accumulated_len / self.total_len) * 100
         pos = index.row() + 1
-        total = len(self.filtered)
+        total = self.message_model.rowCount()
         self.status_left.setText(f"{pos} / {total}")
+        if self.loading or not isinstance(self.data, ThreadStore):
+            # mientras carga, la barra muestra el avance de la carga
+            return
+        current_pos = self.data.row_of_post(self.current_post_id)
+        accumulated_len = self.data.norm_length_through(current_pos)
+        percentage = (accumulated_len / self.total_len) * 100
         self.progress_bar.setValue(int(percentage))
         self.progress_label.setText(f"{percentage:.2f}%")
 
     def select_index_by_post_id(self, post_id, first_load=False):
-        index = None
-        model = self.message_list.model()
-        found = False
-        for row in range(model.rowCount()):
-            index = model.index(row, 0)
-            data = index.data(Qt.UserRole)
-            if data and data.get("post_id") == post_id:
-                found = True
-                break
-        if index and found:
+        row = self.message_model.row_of_post(post_id)
+        if row >= 0:
+            index = self.message_model.index(row, 0)
             self.message_list.setCurrentIndex(index)
             if first_load:
                 self.show_message(index)
@@ -211,8 +267,15 @@ class Keaton(QMainWindow):
 
     def search_messages(self):
         query = self.search_box.text().strip()
-        self.load_messages(query if query else None)
-        self.post_search_input.setText(self.search_box.text().strip())
+        if query and self.search_engine:
+            self.search_pending = True
+            self.search_worker.search(query)
+        else:
+            self.search_worker.cancel(wait=False)
+            self.load_messages()
+        # En el post se resalta el primer texto buscado, sin los filtros
+        terms = parse_query(query).terms
+        self.post_search_input.setText(terms[0] if terms else "")
         self.post_search_bar.setVisible(True)
         self.highlight_all()
 
@@ -226,8 +289,14 @@ class Keaton(QMainWindow):
         self.boton_temas.setMenu(themes_menu)
         self.boton_temas.setPopupMode(QToolButton.InstantPopup)
         self.boton_temas.setText("Temas")
+        self.boton_buscar_todos.setText("Buscar en todos los juegos")
+        self.boton_buscar_todos.clicked.connect(self.open_global_search)
+        self.boton_exportar.setText("Exportar juego")
+        self.boton_exportar.clicked.connect(self.export_current_thread)
         layout = QHBoxLayout()
         layout.addWidget(self.boton_games)
+        layout.addWidget(self.boton_buscar_todos)
+        layout.addWidget(self.boton_exportar)
         layout.addStretch()
         layout.addWidget(self.boton_temas)
         layout.setContentsMargins(0, 0, 0, 0)
@@ -279,6 +348,7 @@ class Keaton(QMainWindow):
             "default": "icons/default.svg"
         }
         icono = QIcon(icons.get(theme_key))
+        self.preview_delegate.theme_changed()
 
         self.boton_temas.setText(f"{theme_key.capitalize()} Theme")
         self.boton_temas.setIcon(icono)
@@ -288,65 +358,126 @@ class Keaton(QMainWindow):
         if self.search_box.text() == "":
             self.search_messages()
         else:
-            self.search_timer.start(800)
+            self.search_timer.start(50)
 
-    def load_thread(self, filename):
+    def load_thread(self, filename, post_id=None):
+        """Empieza a cargar un hilo; si no se indica post, abre el guardado."""
         if filename:
             path = os.path.join(self.threads_dir, filename)
-            self.load_messages_from_file(path)
-            settings = load_settings()
-            self.current_post_id = settings.get(
-                f"current_post_id_{self.thread_id}")
-            self.load_messages()
-            if not self.current_post_id:
-                self.current_post_id = self.get_first_post_id()
-            self.select_index_by_post_id(self.current_post_id, True)
+            if not self.load_messages_from_file(path):
+                return
+            self.pending_post_id = post_id
             new_filename = Path(filename.split("#")[-1]).stem
             self.setWindowTitle(f"Keaton - {new_filename}")
             self.boton_games.setText(new_filename)
             save_setting("json_file", filename)
 
     def load_messages_from_file(self, json_file):
-        # Cargar datos
-        try:
-            with open(json_file, "r", encoding="utf-8") as f:
-                self.data = json.load(f)
-        except FileNotFoundError:
-            pass
-        try:
-            self.thread_id = self.data[0].get("thread_id")
-        except IndexError:
-            pass
-
-        read_cache = False
-        cache_file = json_file + ".cache"
-        if os.path.exists(cache_file):
-            try:
-                with open(cache_file, "r", encoding="utf-8") as f:
-                    cache = json.load(f)
-                if len(cache) == len(self.data) and all(
-                        c["post_id"] == d["post_id"] for c, d in
-                        zip(cache, self.data)
-                ):
-                    for msg, cached in zip(self.data, cache):
-                        msg["message_norm"] = cached["message_norm"]
-                        msg["username_norm"] = cached["username_norm"]
-                    read_cache = True
-            except (json.decoder.JSONDecodeError, KeyError):
-                pass
-        if not read_cache:
-            cache = []
-            for msg in self.data:
-                msg["message_norm"] = strip_accents(msg["message"].lower())
-                msg["username_norm"] = strip_accents(msg["username"].lower())
-                cache.append({
-                    "post_id": msg["post_id"],
-                    "message_norm": msg["message_norm"],
-                    "username_norm": msg["username_norm"]
-                })
-            with open(cache_file, "w", encoding="utf-8") as f:
-                json.dump(cache, f, ensure_ascii=False)
-        self.total_len = sum(len(m["message_norm"]) for m in self.data) or 1
+        # El almacén binario se abre (y se reconstruye si hace falta) en
+        # segundo plano; hasta que esté, la lista se llena por lotes
+        if not os.path.exists(json_file):
+            return False
+        # la carga anterior puede seguir creando índices sobre su almacén:
+        # no se espera a que acabe, el almacén se cierra cuando termine
+        self.load_worker.cancel(wait=False)
+        self.prerender_worker.cancel()
+        self.search_worker.set_engine(None)
+        self.search_engine = None
+        if isinstance(self.data, ThreadStore):
+            self.message_model.set_store([])
+            self.load_worker.release(self.data)
+        self.data = []
+        self.message_model.set_store(self.data)
+        self.json_file = json_file
+        self.thread_id = 0
+        self.loading = True
+        self.total_len = 1
+        self.progress_bar.setValue(0)
+        self.progress_label.setText("0.00%")
+        self.status.showMessage("Cargando...")
+        self.render_cache.set_disk(HtmlStore(json_file))
+        self.load_worker.load(json_file)
+        return True
+
+    def start_reading(self, thread_id):
+        """Con el id del hilo ya se sabe qué post se había dejado abierto."""
+        self.thread_id = thread_id
+        if self.pending_post_id is None:
+            self.pending_post_id = load_settings().get(
+                f"current_post_id_{self.thread_id}") or 0
+
+    def show_pending_post(self):
+        post_id = self.pending_post_id or self.get_first_post_id()
+        self.pending_post_id = None
+        self.current_post_id = post_id
+        self.select_index_by_post_id(post_id, True)
+
+    def on_posts_loaded(self, generation, posts, paint):
+        if generation != self.load_worker.generation:
+            return
+        if not self.data:
+            self.start_reading(posts[0]["thread_id"])
+        self.message_model.append_posts(posts, paint)
+        self.update_search_count()
+        pending = self.pending_post_id
+        if pending is not None and (
+                not pending
+                or any(post["post_id"] == pending for post in posts)):
+            self.show_pending_post()
+
+    def on_load_progress(self, generation, done, total):
+        if generation != self.load_worker.generation:
+            return
+        percentage = done / total * 100 if total else 100
+        self.progress_bar.setValue(int(percentage))
+        self.status.showMessage(f"Cargando... {percentage:.0f}%")
+
+    def on_store_ready(self, generation, store, paint):
+        if generation != self.load_worker.generation:
+            store.close()
+            return
+        # Si la lista se llenó por lotes, tiene los mismos posts en el mismo
+        # orden que el almacén y basta con cambiar el origen
+        if self.data:
+            self.message_model.swap_store(store)
+        else:
+            self.message_model.set_store(store, paint)
+            if len(store):
+                self.start_reading(store[0]["thread_id"])
+        self.data = store
+        self.total_len = store.total_norm_length() or 1
+        self.loading = False
+        self.status.clearMessage()
+        if self.pending_post_id is not None:
+            self.show_pending_post()
+        self.finish_search()
+        if load_settings().get("prewarm_html", True):
+            self.prerender_worker.prewarm(store)
+
+    def on_engine_ready(self, generation, engine):
+        if generation != self.load_worker.generation:
+            return
+        self.search_engine = engine
+        self.search_worker.set_engine(engine)
+        # lo que se escribió durante la carga no se pudo buscar todavía
+        if self.search_box.text().strip():
+            self.search_messages()
+
+    def on_load_failed(self, generation, error):
+        if generation != self.load_worker.generation:
+            return
+        self.loading = False
+        # lo que llegó por lotes es un hilo a medias: la lista queda vacía
+        self.data = []
+        self.message_model.set_store(self.data)
+        self.pending_post_id = None
+        self.total_len = 1
+        self.progress_bar.setValue(0)
+        self.progress_label.setText("0.00%")
+        self.status_left.setText("")
+        self.status.clearMessage()
+        QMessageBox.warning(self, "Cargar juego",
+                            f"No se pudo cargar {self.json_file}:\n{error}")
 
     def toggle_post_search(self, visible):
         self.post_search_bar.setVisible(visible)
@@ -408,6 +539,8 @@ class Keaton(QMainWindow):
         # Atajo Ctrl+F
         shortcut = QShortcut(QKeySequence("Ctrl+F"), self)
         shortcut.activated.connect(lambda: self.toggle_post_search(True))
+        shortcut_global = QShortcut(QKeySequence("Ctrl+Shift+F"), self)
+        shortcut_global.activated.connect(self.open_global_search)
 
         # Highlight
         self.post_search_input.textChanged.connect(lambda: self.search_timer_post.start(400))
@@ -460,6 +593,59 @@ class Keaton(QMainWindow):
         self.current_match_index = -1
         self.find_next()
 
+    def open_global_search(self):
+        if self.global_search is None:
+            self.global_search = GlobalSearchDialog(self.threads_dir, self)
+            self.global_search.post_selected.connect(self.open_post)
+        self.global_search.show()
+        self.global_search.raise_()
+        self.global_search.search_box.setFocus()
+
+    def open_post(self, filename, post_id):
+        self.load_thread(filename, post_id)
+
+    def export_current_thread(self):
+        if not self.json_file or self.export_worker.running:
+            return
+        title = Path(self.json_file.split("#")[-1]).stem
+        output, selected = QFileDialog.getSaveFileName(
+            self, "Exportar juego", f"{title}.epub",
+            "EPUB (*.epub);;Páginas HTML (carpeta)")
+        if not output:
+            return
+        if selected.startswith("EPUB"):
+            if not output.lower().endswith(".epub"):
+                output += ".epub"
+        elif output.lower().endswith(".epub"):
+            output = output[:-len(".epub")]
+        self.boton_exportar.setEnabled(False)
+        self.status.showMessage("Exportando...")
+        self.export_worker.export(self.json_file, output)
+
+    def on_export_progress(self, done, total):
+        self.status.showMessage(f"Exportando... {done} / {total} posts")
+
+    def on_export_finished(self, output, pages):
+        self.boton_exportar.setEnabled(True)
+        self.status.showMessage(
+            f"Exportado en {output} ({pages} páginas)", 10000)
+
+    def on_export_failed(self, output, error):
+        self.boton_exportar.setEnabled(True)
+        self.status.clearMessage()
+        QMessageBox.warning(self, "Exportar juego",
+                            f"No se pudo exportar a {output}:\n{error}")
+
+    def closeEvent(self, event):
+        self.load_worker.cancel()
+        self.prerender_worker.cancel()
+        self.search_worker.cancel()
+        self.export_worker.cancel()
+        if self.global_search is not None:
+            self.global_search.shutdown()
+        get_settings().flush()
+        super().closeEvent(event)
+
     def check_scroll_end(self, value):
         bar = self.message_view.verticalScrollBar()
         if value >= bar.maximum():
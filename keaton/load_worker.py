@@ -0,0 +1,77 @@
+from PySide6.QtCore import QObject, QThreadPool, Signal
+
+from .message_model import paint_rows
+from .search import SearchEngine
+from .thread_store import ThreadStore
+
+
+class LoadWorker(QObject):
+    """Abre un hilo fuera del hilo de la interfaz.
+
+    Si el almacén hay que reconstruirlo, los posts llegan por lotes según se
+    normalizan, para ir llenando la lista. Después llega el almacén y, por
+    último, el buscador con sus índices. Los datos de pintado de la lista
+    (`paint_rows`) se preparan aquí y viajan con los posts o con el
+    almacén. Como en las búsquedas, cada carga
+    lleva un número de generación y las señales de una carga anterior se
+    descartan.
+    """
+    posts_loaded = Signal(int, list, list)
+    progress = Signal(int, int, int)
+    # los datos de pintado son None si los posts ya llegaron por lotes
+    store_ready = Signal(int, object, object)
+    engine_ready = Signal(int, object)
+    failed = Signal(int, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.generation = 0
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+
+    def load(self, json_file):
+        self.generation += 1
+        generation = self.generation
+        self._pool.start(lambda: self._run(json_file, generation))
+        return generation
+
+    def cancel(self, wait=True):
+        """Cancela la carga en curso y, si se pide, espera a que termine."""
+        self.generation += 1
+        if wait:
+            self._pool.waitForDone()
+
+    def release(self, store):
+        """Cierra un almacén cuando la carga en curso haya terminado con él."""
+        self._pool.start(store.close)
+
+    def _run(self, json_file, generation):
+        def cancelled():
+            return generation != self.generation
+
+        streamed = False
+
+        def on_posts(posts, done, total):
+            nonlocal streamed
+            if not cancelled():
+                streamed = True
+                self.posts_loaded.emit(generation, posts, paint_rows(posts))
+                self.progress.emit(generation, done, total)
+
+        try:
+            store = ThreadStore.open(json_file, on_posts, cancelled)
+            if store is None:
+                return
+            paint = None if streamed else paint_rows(store)
+            if cancelled():
+                store.close()
+                return
+            # a partir de aquí el almacén es de la interfaz, que lo cierra
+            self.store_ready.emit(generation, store, paint)
+            engine = SearchEngine.open(json_file, store, cancelled)
+        except Exception as e:
+            if not cancelled():
+                self.failed.emit(generation, str(e))
+            return
+        if not cancelled():
+            self.engine_ready.emit(generation, engine)
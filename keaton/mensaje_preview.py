@@ -1,89 +1,127 @@
+from collections import OrderedDict
+
 from PySide6.QtWidgets import QStyledItemDelegate, QStyle
-from PySide6.QtGui import QFont, QColor
-from PySide6.QtCore import QRect, QSize, Qt
+from PySide6.QtGui import QFont, QColor, QFontMetrics, QPainter, QPixmap
+from PySide6.QtCore import QPoint, QRect, QSize, Qt
+
+from .message_model import PAINT_ROLE
+from .utils import BADGE_MINI_UPDATE, BADGE_UPDATE
+
+# Badge colores independientes del tema
+BADGE_STYLES = {
+    BADGE_UPDATE: ("Actualización", "#2980b9", "#ffffff"),
+    BADGE_MINI_UPDATE: ("Miniactualización", "#d35400", "#ffffff"),
+}
 
-from .utils import strip_bbcode, get_user_color
+# filas ya pintadas que se guardan como imagen
+ROW_CACHE_SIZE = 128
 
 
 class MensajePreview(QStyledItemDelegate):
+    """Pinta una fila de la lista con los datos que el modelo ya preparó.
+
+    Las fuentes, sus métricas y el tamaño de los badges se calculan una vez
+    por tema. Además, las últimas `cache_size` filas pintadas se guardan como
+    imagen (LRU por fila, tamaño, selección y escala), así que desplazarse
+    por la lista sólo copia imágenes; con 0 no se guarda ninguna.
+    `theme_changed` descarta todo lo calculado para el tema anterior.
+    """
+
+    def __init__(self, parent=None, cache_size=ROW_CACHE_SIZE):
+        super().__init__(parent)
+        self.cache_size = cache_size
+        self._pixmaps = OrderedDict()
+        self.user_font = QFont("Segoe UI", 10, QFont.Bold)
+        self.date_font = QFont("Segoe UI", 8)
+        self.badge_font = QFont("Segoe UI", 8, QFont.Bold)
+        self.preview_font = QFont("Segoe UI", 9)
+        self._badges = None
+
+    def theme_changed(self):
+        self._badges = None
+        self._pixmaps.clear()
+
+    def badges(self):
+        """Badge → (texto, ancho, alto, fondo, color del texto)."""
+        if self._badges is None:
+            metrics = QFontMetrics(self.badge_font)
+            self._badges = {
+                badge: (text, metrics.horizontalAdvance(text) + 10,
+                        metrics.height(), QColor(bg), QColor(fg))
+                for badge, (text, bg, fg) in BADGE_STYLES.items()}
+        return self._badges
+
     def paint(self, painter, option, index):
-        data = index.data(Qt.UserRole)
+        data = index.data(PAINT_ROLE)
         if not data:
             return super().paint(painter, option, index)
-
-        rect = option.rect
+        if not self.cache_size:
+            return self.paint_row(painter, option, data, option.rect)
+
+        size = option.rect.size()
+        ratio = painter.device().devicePixelRatio()
+        key = (data, size.width(), size.height(),
+               bool(option.state & QStyle.State_Selected),
+               option.palette.currentColorGroup(), ratio)
+        pixmap = self._pixmaps.get(key)
+        if pixmap is None:
+            pixmap = QPixmap(size * ratio)
+            pixmap.setDevicePixelRatio(ratio)
+            pixmap.fill(Qt.transparent)
+            pixmap_painter = QPainter(pixmap)
+            self.paint_row(pixmap_painter, option, data,
+                           QRect(QPoint(0, 0), size))
+            pixmap_painter.end()
+            self._pixmaps[key] = pixmap
+            while len(self._pixmaps) > self.cache_size:
+                self._pixmaps.popitem(last=False)
+        else:
+            self._pixmaps.move_to_end(key)
+        painter.drawPixmap(option.rect.topLeft(), pixmap)
+
+    def paint_row(self, painter, option, data, rect):
         painter.save()
 
         palette = option.palette  # <- aquí agarramos colores del tema
+        selected = option.state & QStyle.State_Selected
 
         # Fondo al seleccionar
-        if option.state & QStyle.State_Selected:
+        if selected:
             painter.fillRect(rect, palette.highlight())
+        text_color = (palette.highlightedText().color() if selected
+                      else palette.text().color())
 
         # --- Usuario ---
-        user_font = QFont("Segoe UI", 10, QFont.Bold)
-        painter.setFont(user_font)
-        username = data["username"]
-        user_color = get_user_color(username)
-        painter.setPen(user_color)
+        painter.setFont(self.user_font)
+        painter.setPen(data.color)
 
         user_x = rect.left() + 5
         user_y = rect.top() + 5
         painter.drawText(QRect(user_x, user_y, rect.width() - 120, 20),
-                         Qt.AlignVCenter | Qt.AlignLeft, data["username"])
+                         Qt.AlignVCenter | Qt.AlignLeft, data.username)
 
         # --- Fecha ---
-        date_font = QFont("Segoe UI", 8)
-        painter.setFont(date_font)
-        date_color = (palette.highlightedText().color()
-                      if option.state & QStyle.State_Selected
-                      else palette.text().color())  # gris medio
-        painter.setPen(date_color)
+        painter.setFont(self.date_font)
+        painter.setPen(text_color)
         painter.drawText(QRect(rect.right() - 100, rect.top() + 5, 95, 20),
-                         Qt.AlignVCenter | Qt.AlignRight, data["date"])
+                         Qt.AlignVCenter | Qt.AlignRight, data.date)
 
         # --- Indicador de actualización ---
-        clean_message = strip_bbcode(data["message"]).lstrip().lower()
-        if (clean_message.startswith("actualización")
-                or clean_message.startswith("actualizacion")
-                or clean_message.startswith("miniactualización")
-                or clean_message.startswith("miniactualizacion")
-                or clean_message.startswith("interludio")):
-            badge_text = "Actualización"
-            badge_font = QFont("Segoe UI", 8, QFont.Bold)
-            painter.setFont(badge_font)
-
-            # Badge colores independientes del tema
-            badge_bg = QColor("#2980b9")
-            badge_fg = QColor("#ffffff")
-
-            if (clean_message.startswith("miniactualización")
-                    or clean_message.startswith("miniactualizacion")):
-                badge_text = "Miniactualización"
-                badge_bg = QColor("#d35400")
-                badge_fg = QColor("#ffffff")
-
-            metrics = painter.fontMetrics()
-            text_width = metrics.horizontalAdvance(badge_text) + 10
-            text_height = metrics.height()
-            badge_rect = QRect(user_x + 100, user_y, text_width, text_height)
-
+        badge = self.badges().get(data.badge)
+        if badge is not None:
+            badge_text, width, height, badge_bg, badge_fg = badge
+            painter.setFont(self.badge_font)
+            badge_rect = QRect(user_x + 100, user_y, width, height)
             painter.fillRect(badge_rect, badge_bg)
             painter.setPen(badge_fg)
             painter.drawText(badge_rect, Qt.AlignCenter, badge_text)
 
         # --- Preview ---
-        preview_font = QFont("Segoe UI", 9)
-        painter.setFont(preview_font)
-        preview_color = (palette.highlightedText().color()
-                         if option.state & QStyle.State_Selected
-                         else palette.text().color())
-        painter.setPen(preview_color)
-
-        preview = data["preview"]
+        painter.setFont(self.preview_font)
+        painter.setPen(text_color)
         painter.drawText(QRect(rect.left() + 5, rect.top() + 25,
                                rect.width() - 10, 35),
-                         Qt.TextWordWrap, preview)
+                         Qt.TextWordWrap, data.preview)
 
         painter.restore()
 
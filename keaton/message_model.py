@@ -0,0 +1,182 @@
+from PySide6.QtCore import QAbstractListModel, QModelIndex, Qt
+from PySide6.QtGui import QColor
+
+from .thread_store import ThreadStore
+from .utils import format_date, get_user_color
+
+# rol con los datos de pintado de la fila (RowPaint)
+PAINT_ROLE = Qt.UserRole + 1
+
+_user_colors = {}
+
+
+def user_color(username):
+    color = _user_colors.get(username)
+    if color is None:
+        color = _user_colors[username] = QColor(get_user_color(username))
+    return color
+
+
+class RowPaint:
+    """Lo que el delegado pinta de un post, preparado al cargar el hilo."""
+    __slots__ = ("username", "color", "date", "badge", "preview")
+
+    def __init__(self, username, post_date, badge, preview):
+        self.username = username
+        self.color = user_color(username)
+        self.date = format_date(post_date)
+        self.badge = badge
+        self.preview = preview
+
+
+def paint_rows(posts):
+    """Datos de pintado de cada post, en orden."""
+    if isinstance(posts, ThreadStore):
+        fields = zip(posts.column("username"), posts.column("post_date"),
+                     posts.column("badge"),
+                     (posts.field(row, "preview")
+                      for row in range(len(posts))))
+    else:
+        fields = ((post["username"], post["post_date"], post["badge"],
+                   post["preview"]) for post in posts)
+    return [RowPaint(*row) for row in fields]
+
+
+class ListRow:
+    """Lo que la lista muestra de un post, leído sólo cuando se pide.
+
+    Además de los campos del post, da "date" ya formateada y "preview".
+    """
+    __slots__ = ("_model", "_store_row")
+
+    def __init__(self, model, store_row):
+        self._model = model
+        self._store_row = store_row
+
+    def __getitem__(self, key):
+        if key == "preview":
+            return self._model.row_paint(self._store_row).preview
+        post = self._model.post_at(self._store_row)
+        if key == "date":
+            return format_date(post["post_date"])
+        return post[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class MessageListModel(QAbstractListModel):
+    """Modelo virtual sobre el almacén del hilo.
+
+    El filtro es sólo una lista de filas del almacén; los datos de cada
+    fila se leen del almacén cuando la vista los pide, salvo lo que pinta
+    el delegado, que se prepara al cargar (ver `paint_rows`).
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._store = []
+        self._rows = []
+        self._paint = []
+        # post_id → fila del almacén, y fila del almacén → fila de la lista
+        # (ésta se calcula al pedirla si el filtro no es un rango)
+        self._post_rows = {}
+        self._positions = None
+
+    def set_store(self, store, paint=None):
+        self.beginResetModel()
+        self._store = store
+        self._rows = range(len(store))
+        self._paint = paint if paint is not None else paint_rows(store)
+        if isinstance(store, ThreadStore):
+            self._post_rows = store.post_rows()
+        else:
+            self._post_rows = {}
+            self._add_post_rows(store, 0)
+        self._positions = None
+        self.endResetModel()
+
+    def _add_post_rows(self, posts, start):
+        for store_row, post in enumerate(posts, start):
+            self._post_rows.setdefault(post["post_id"], store_row)
+
+    def append_posts(self, posts, paint=None):
+        """Añade posts a un origen que todavía es una lista (carga en curso)."""
+        start = len(self._store)
+        self._store.extend(posts)
+        self._paint.extend(paint if paint is not None else paint_rows(posts))
+        self._add_post_rows(posts, start)
+        self.append_rows(list(range(start, start + len(posts))))
+
+    def swap_store(self, store):
+        """Cambia el origen sin reiniciar la vista.
+
+        El nuevo origen debe tener los mismos posts en el mismo orden.
+        """
+        self._store = store
+        self._post_rows = store.post_rows()
+
+    def set_rows(self, rows):
+        self.beginResetModel()
+        self._rows = rows
+        self._positions = None
+        self.endResetModel()
+
+    def append_rows(self, rows):
+        if not rows:
+            return
+        if not isinstance(self._rows, list):
+            self._rows = list(self._rows)
+        start = len(self._rows)
+        self.beginInsertRows(QModelIndex(), start, start + len(rows) - 1)
+        self._rows.extend(rows)
+        if self._positions is not None:
+            for row, store_row in enumerate(rows, start):
+                self._positions.setdefault(store_row, row)
+        self.endInsertRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def store_row(self, row):
+        return self._rows[row]
+
+    def post(self, row):
+        return self._store[self._rows[row]]
+
+    def post_at(self, store_row):
+        return self._store[store_row]
+
+    def row_of_post(self, post_id):
+        store_row = self._post_rows.get(post_id)
+        if store_row is None:
+            return -1
+        if isinstance(self._rows, range):
+            if store_row not in self._rows:
+                return -1
+            return self._rows.index(store_row)
+        if self._positions is None:
+            self._positions = {}
+            for row, stored in enumerate(self._rows):
+                self._positions.setdefault(stored, row)
+        return self._positions.get(store_row, -1)
+
+    def row_paint(self, store_row):
+        return self._paint[store_row]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self._rows):
+            return None
+        store_row = self._rows[index.row()]
+        if role == PAINT_ROLE:
+            return self._paint[store_row]
+        if role == Qt.UserRole:
+            return ListRow(self, store_row)
+        if role == Qt.DisplayRole:
+            return self._store[store_row]["username"]
+        return None
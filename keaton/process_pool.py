@@ -0,0 +1,8 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def make_executor(max_workers=None):
+    # spawn evita heredar el estado de Qt del proceso principal
+    return ProcessPoolExecutor(
+        max_workers, mp_context=multiprocessing.get_context("spawn"))
@@ -0,0 +1,89 @@
+import re
+from datetime import datetime
+
+from .utils import BADGE_NAMES, strip_accents
+
+# operador:valor, operador:"valor con espacios", "frase exacta" o palabra
+QUERY_TOKEN_RE = re.compile(r'(\w+):"([^"]*)"?|(\w+):(\S+)|"([^"]*)"?|(\S+)')
+DATE_RE = re.compile(r"(\d{4})(?:[-/](\d{1,2}))?(?:[-/](\d{1,2}))?$")
+OPERATORS = ("user", "before", "after", "badge")
+
+
+class Query:
+    """Consulta de búsqueda ya interpretada.
+
+    - terms: subcadenas normalizadas que deben aparecer todas
+    - users: nombres normalizados (basta con uno)
+    - after / before: límites de post_date, after incluido y before no
+    - badges: tipos de actualización (basta con uno)
+    """
+
+    def __init__(self):
+        self.terms = []
+        self.users = set()
+        self.after = None
+        self.before = None
+        self.badges = set()
+
+    def __bool__(self):
+        return bool(self.terms or self.has_filters())
+
+    def has_filters(self):
+        return bool(self.users or self.badges or self.after is not None
+                    or self.before is not None)
+
+    def filters(self):
+        return (frozenset(self.users), frozenset(self.badges), self.after,
+                self.before)
+
+    def key(self):
+        return tuple(sorted(set(self.terms))), self.filters()
+
+    def narrows(self, other):
+        """True si todos los resultados de esta consulta lo son de `other`."""
+        return (self.filters() == other.filters()
+                and all(any(term in mine for mine in self.terms)
+                        for term in other.terms))
+
+
+def parse_date(value):
+    """Convierte AAAA, AAAA-MM o AAAA-MM-DD en el timestamp de su comienzo."""
+    match = DATE_RE.match(value)
+    if not match:
+        return None
+    year, month, day = (int(g) if g else 1 for g in match.groups())
+    try:
+        return int(datetime(year, month, day).timestamp())
+    except ValueError:
+        return None
+
+
+def parse_query(text):
+    query = Query()
+    for match in QUERY_TOKEN_RE.finditer(text or ""):
+        operator = (match.group(1) or match.group(3) or "").lower()
+        value = match.group(2) if match.group(1) else match.group(4)
+        if operator not in OPERATORS:
+            phrase = match.group(5)
+            term = phrase if phrase is not None else match.group(0)
+            term = strip_accents(term.lower())
+            if term:
+                query.terms.append(term)
+            continue
+        value = strip_accents(value.lower()).strip()
+        if operator == "user":
+            query.users.add(value)
+        elif operator == "badge":
+            # un nombre desconocido no coincide con ningún post
+            query.badges.add(BADGE_NAMES.get(value, -1))
+        elif operator == "after":
+            date = parse_date(value)
+            if date is not None:
+                query.after = (date if query.after is None
+                               else max(query.after, date))
+        elif operator == "before":
+            date = parse_date(value)
+            if date is not None:
+                query.before = (date if query.before is None
+                                else min(query.before, date))
+    return query
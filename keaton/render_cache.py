@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+
+from .fast_bbcode import render_message, renderer_version
+
+PREWARM_BATCH = 50
+
+
+class RenderCache:
+    """LRU del HTML de los posts, por post_id y versión del renderizador.
+
+    Si tiene un HtmlStore, los posts que no están en memoria se buscan ahí
+    antes de renderizarlos, y lo renderizado se guarda también en disco.
+    """
+
+    def __init__(self, max_entries=64, disk=None):
+        self.max_entries = max_entries
+        self.disk = disk
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, post_id):
+        with self._lock:
+            return (post_id, renderer_version()) in self._entries
+
+    def set_disk(self, disk):
+        if self.disk is not None:
+            self.disk.close()
+        self.disk = disk
+
+    def get(self, post_id):
+        key = (post_id, renderer_version())
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+            return html
+
+    def put(self, post_id, html):
+        key = (post_id, renderer_version())
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def render(self, post_id, message):
+        html = self.get(post_id)
+        if html is None:
+            if self.disk is not None:
+                html = self.disk.get(message)
+            if html is None:
+                html = render_message(message)
+                if self.disk is not None:
+                    self.disk.put(message, html)
+            self.put(post_id, html)
+        return html
+
+    def prewarm(self, store, cancelled=None):
+        """Renderiza en disco todos los posts del almacén que falten."""
+        if self.disk is None:
+            return
+        pending = []
+        for row in range(len(store)):
+            if cancelled and cancelled():
+                break
+            message = store[row]["message"]
+            if self.disk.get(message) is None:
+                pending.append((message, render_message(message)))
+            if len(pending) >= PREWARM_BATCH:
+                self.disk.put_many(pending)
+                pending = []
+        self.disk.put_many(pending)
@@ -0,0 +1,45 @@
+from PySide6.QtCore import QObject, QThreadPool
+
+
+class PrerenderWorker(QObject):
+    """Renderiza en segundo plano los posts vecinos al que se está leyendo.
+
+    Pedir otro grupo de posts descarta lo que quedara pendiente del anterior.
+    Aparte, puede precalentar la caché en disco con todo el hilo.
+    """
+
+    def __init__(self, cache, parent=None):
+        super().__init__(parent)
+        self.cache = cache
+        self.generation = 0
+        self.prewarm_generation = 0
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+        self._prewarm_pool = QThreadPool(self)
+        self._prewarm_pool.setMaxThreadCount(1)
+
+    def prerender(self, posts):
+        """posts: lista de (post_id, message)."""
+        self.generation += 1
+        generation = self.generation
+        if posts:
+            self._pool.start(lambda: self._run(posts, generation))
+
+    def prewarm(self, store):
+        self.prewarm_generation += 1
+        generation = self.prewarm_generation
+        self._prewarm_pool.start(lambda: self.cache.prewarm(
+            store, lambda: generation != self.prewarm_generation))
+
+    def cancel(self):
+        self.generation += 1
+        self.prewarm_generation += 1
+        self._pool.waitForDone()
+        self._prewarm_pool.waitForDone()
+
+    def _run(self, posts, generation):
+        for post_id, message in posts:
+            if generation != self.generation:
+                return
+            if post_id not in self.cache:
+                self.cache.render(post_id, message)
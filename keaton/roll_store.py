@@ -0,0 +1,47 @@
+import json
+import os
+import threading
+
+ROLLS_FILE = os.path.join("data", "rolls.json")
+
+
+class RollStore:
+    """Tiradas de dados indexadas por dice_code y por post_id."""
+
+    def __init__(self, rolls):
+        self._by_code = {}
+        self._by_post = {}
+        for roll in rolls:
+            self._by_code.setdefault(roll.get("dice_code"), roll)
+            self._by_post.setdefault(roll.get("post_id"), []).append(roll)
+
+    @classmethod
+    def from_file(cls, path=ROLLS_FILE):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls(json.load(f))
+        except FileNotFoundError:
+            return cls([])
+
+    def __len__(self):
+        return len(self._by_code)
+
+    def by_code(self, dice_code):
+        return self._by_code.get(dice_code)
+
+    def by_post(self, post_id):
+        return self._by_post.get(post_id, [])
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_roll_store():
+    """Carga rolls.json una sola vez, la primera vez que se necesita."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = RollStore.from_file()
+    return _store
@@ -0,0 +1,122 @@
+import threading
+from collections import OrderedDict
+
+from .query import parse_query
+from .search_index import TrigramIndex, WordIndex, make_facet_index
+
+
+class SearchEngine:
+    """Búsqueda de posts de un hilo apoyada en sus índices."""
+
+    RECENT_RESULTS = 32
+
+    def __init__(self, store, word_index=None, trigram_index=None):
+        self.store = store
+        self.word_index = word_index
+        self.trigram_index = trigram_index
+        self.facets = make_facet_index(store)
+        # clave de la consulta → (consulta, filas encontradas), de la menos a
+        # la más reciente
+        self._recent = OrderedDict()
+        self._recent_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, json_file, store, cancelled=None):
+        """Motor con los índices del hilo; None si `cancelled()` lo corta."""
+        word_index = WordIndex.open(json_file, store, cancelled)
+        if word_index is None:
+            return None
+        trigram_index = TrigramIndex.open(json_file, store, cancelled)
+        if trigram_index is None:
+            return None
+        return cls(store, word_index, trigram_index)
+
+    def _recent_results(self, query):
+        """Busca resultados previos reutilizables para la consulta.
+
+        Devuelve (filas, exacto). Si no hay resultado para la misma consulta,
+        usa el más pequeño de una consulta más amplia que ésta: sus filas son
+        un superconjunto de las que se buscan.
+        """
+        key = query.key()
+        with self._recent_lock:
+            cached = self._recent.get(key)
+            if cached is not None:
+                self._recent.move_to_end(key)
+                return cached[1], True
+            wider = [rows for previous, rows in self._recent.values()
+                     if query.narrows(previous)]
+        if wider:
+            return min(wider, key=len), False
+        return None, False
+
+    def _remember(self, query, rows):
+        key = query.key()
+        with self._recent_lock:
+            self._recent[key] = (query, rows)
+            self._recent.move_to_end(key)
+            while len(self._recent) > self.RECENT_RESULTS:
+                self._recent.popitem(last=False)
+
+    def _term_candidates(self, term):
+        rows = None
+        if self.trigram_index:
+            rows = self.trigram_index.candidates(term)
+        if rows is None and self.word_index:
+            rows = self.word_index.candidates(term)
+        return rows
+
+    def candidates(self, query):
+        term_rows = []
+        for term in query.terms:
+            rows = self._term_candidates(term)
+            if rows is not None:
+                term_rows.append(rows)
+        return self.facets.combine(query, term_rows)
+
+    def matches(self, row, terms):
+        if not terms:
+            return True
+        post = self.store[row]
+        text = post["message_norm"]
+        username = post["username_norm"]
+        return all(term in text or term in username for term in terms)
+
+    def search(self, text, cancelled=None, batch_size=100):
+        """Genera las filas que coinciden con la consulta, por lotes.
+
+        Si `cancelled()` devuelve True la búsqueda se abandona sin terminar.
+        """
+        query = parse_query(text)
+        if not query:
+            rows = range(len(self.store))
+            for start in range(0, len(rows), batch_size):
+                yield list(rows[start:start + batch_size])
+            return
+
+        rows, exact = self._recent_results(query)
+        if exact:
+            for start in range(0, len(rows), batch_size):
+                yield rows[start:start + batch_size]
+            return
+        if rows is None:
+            rows = self.candidates(query)
+
+        found = []
+        batch = []
+        for row in rows:
+            if cancelled and cancelled():
+                return
+            if self.matches(row, query.terms):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    found.extend(batch)
+                    yield batch
+                    batch = []
+        if batch:
+            found.extend(batch)
+            yield batch
+        self._remember(query, found)
+
+    def search_all(self, text):
+        return [row for batch in self.search(text) for row in batch]
@@ -0,0 +1,344 @@
+import json
+import os
+import re
+import struct
+from array import array
+from bisect import bisect_left
+
+from .utils import write_temp
+
+try:
+    import numpy
+except ImportError:  # numpy es opcional; sin él se filtra con conjuntos
+    numpy = None
+
+TOKEN_RE = re.compile(r"\w+")
+
+INDEX_MAGIC = b"KTIX"
+INDEX_VERSION = 2
+# magic, versión, filas indexadas, huella de esas filas en el almacén,
+# longitud de la cabecera json con el vocabulario
+INDEX_HEADER = struct.Struct("<4sII16sI")
+
+
+def _save_postings(path, store, count, postings):
+    keys = list(postings)
+    lengths = [len(postings[k]) for k in keys]
+    vocab = json.dumps({"keys": keys, "lengths": lengths}).encode("ascii")
+    header = INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, count,
+                               store.prefix_digest(count), len(vocab))
+
+    def write(f):
+        f.write(header)
+        f.write(vocab)
+        for k in keys:
+            postings[k].tofile(f)
+
+    tmp_file = write_temp(path, write)
+    try:
+        os.replace(tmp_file, path)
+    except OSError:
+        os.remove(tmp_file)
+        raise
+
+
+def _load_postings(path, store):
+    """Devuelve (filas indexadas, {clave: array de filas}) o None.
+
+    El índice sigue siendo válido si las filas que cubre no cambiaron en el
+    almacén, aunque éste tenga posts nuevos al final.
+    """
+    try:
+        with open(path, "rb") as f:
+            magic, version, count, digest, vocab_len = (
+                INDEX_HEADER.unpack(f.read(INDEX_HEADER.size)))
+            if (magic != INDEX_MAGIC or version != INDEX_VERSION
+                    or count > len(store)
+                    or digest != store.prefix_digest(count)):
+                return None
+            vocab = json.loads(f.read(vocab_len).decode("ascii"))
+            rows = array("I")
+            rows.frombytes(f.read())
+    except (OSError, ValueError, struct.error):
+        return None
+    postings = {}
+    start = 0
+    for key, length in zip(vocab["keys"], vocab["lengths"]):
+        postings[key] = rows[start:start + length]
+        start += length
+    return count, postings
+
+
+def intersect(row_sets):
+    """Intersección de conjuntos de filas, empezando por el más pequeño."""
+    result = None
+    for rows in sorted(row_sets, key=len):
+        result = set(rows) if result is None else result.intersection(rows)
+        if not result:
+            break
+    return sorted(result) if result is not None else []
+
+
+def bitmap_rows(bitmap):
+    """Filas con el bit encendido en un mapa de bits (entero)."""
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+    return {i * 8 + bit for i, byte in enumerate(data) if byte
+            for bit in range(8) if byte >> bit & 1}
+
+
+class PostingIndex:
+    """Índice invertido clave → filas, persistido junto al almacén."""
+    SUFFIX = ""
+
+    def __init__(self, postings=None, count=0):
+        self.postings = postings if postings is not None else {}
+        self.count = count
+
+    @staticmethod
+    def keys_for(post):
+        raise NotImplementedError
+
+    def update(self, store, cancelled=None):
+        """Indexa sólo las filas del almacén que aún no estén indexadas.
+
+        Si `cancelled()` devuelve True se para; `count` dice hasta dónde llegó.
+        """
+        for row in range(self.count, len(store)):
+            if cancelled is not None and cancelled():
+                self.count = row
+                return
+            for key in self.keys_for(store[row]):
+                self.postings.setdefault(key, array("I")).append(row)
+        self.count = len(store)
+
+    @classmethod
+    def build(cls, store):
+        index = cls()
+        index.update(store)
+        return index
+
+    @classmethod
+    def open(cls, json_file, store, cancelled=None):
+        """Carga el índice del disco y lo completa; None si se cancela."""
+        path = json_file + cls.SUFFIX
+        loaded = _load_postings(path, store)
+        if loaded:
+            count, postings = loaded
+            index = cls(postings, count)
+        else:
+            index = cls()
+        if not loaded or index.count < len(store):
+            index.update(store, cancelled)
+            if index.count < len(store):
+                return None
+            try:
+                _save_postings(path, store, index.count, index.postings)
+            except OSError:
+                pass
+        return index
+
+
+class WordIndex(PostingIndex):
+    """Índice invertido palabra → filas sobre message_norm/username_norm."""
+    SUFFIX = ".words"
+
+    @staticmethod
+    def keys_for(post):
+        words = set(TOKEN_RE.findall(post["message_norm"]))
+        words.update(TOKEN_RE.findall(post["username_norm"]))
+        return words
+
+    def __init__(self, postings=None, count=0):
+        super().__init__(postings, count)
+        self._sort_vocabulary()
+
+    def update(self, store, cancelled=None):
+        super().update(store, cancelled)
+        self._sort_vocabulary()
+
+    def _sort_vocabulary(self):
+        self._prefixes = sorted(self.postings)
+        self._suffixes = sorted(word[::-1] for word in self.postings)
+
+    def _words_with_prefix(self, prefix):
+        i = bisect_left(self._prefixes, prefix)
+        while i < len(self._prefixes) and self._prefixes[i].startswith(prefix):
+            yield self._prefixes[i]
+            i += 1
+
+    def _words_with_suffix(self, suffix):
+        reverse = suffix[::-1]
+        i = bisect_left(self._suffixes, reverse)
+        while i < len(self._suffixes) and self._suffixes[i].startswith(reverse):
+            yield self._suffixes[i][::-1]
+            i += 1
+
+    def _rows_for(self, token, left_open, right_open):
+        if left_open and right_open:
+            words = (w for w in self.postings if token in w)
+        elif left_open:
+            words = self._words_with_suffix(token)
+        elif right_open:
+            words = self._words_with_prefix(token)
+        else:
+            return set(self.postings.get(token, ()))
+        rows = set()
+        for word in words:
+            rows.update(self.postings[word])
+        return rows
+
+    def candidates(self, query_norm):
+        """Filas que pueden contener query_norm, o None si no se puede acotar.
+
+        Las palabras interiores de la consulta deben aparecer completas; la
+        primera puede ser el final de una palabra y la última su comienzo.
+        """
+        tokens = TOKEN_RE.findall(query_norm)
+        if not tokens:
+            return None
+        starts_open = bool(TOKEN_RE.match(query_norm))
+        ends_open = bool(TOKEN_RE.fullmatch(query_norm[-1]))
+        last = len(tokens) - 1
+        return intersect([self._rows_for(token, i == 0 and starts_open,
+                                         i == last and ends_open)
+                          for i, token in enumerate(tokens)])
+
+
+class TrigramIndex(PostingIndex):
+    """Índice de trigramas para búsquedas de subcadenas sin acentos."""
+    SUFFIX = ".trigrams"
+
+    @staticmethod
+    def keys_for(post):
+        grams = set()
+        for text in (post["message_norm"], post["username_norm"]):
+            grams.update(text[i:i + 3] for i in range(len(text) - 2))
+        return grams
+
+    def candidates(self, query_norm):
+        """Filas que contienen todos los trigramas de la consulta.
+
+        Devuelve None si la consulta es demasiado corta para acotarla.
+        """
+        if len(query_norm) < 3:
+            return None
+        grams = {query_norm[i:i + 3] for i in range(len(query_norm) - 2)}
+        return intersect([self.postings.get(g, ()) for g in grams])
+
+
+class FacetIndex:
+    """Índices para los filtros de la consulta.
+
+    Usuario → filas, fechas ordenadas (con su fila) para buscar rangos con
+    bisect y un mapa de bits por tipo de actualización.
+    """
+
+    def __init__(self, store):
+        self.users = {}
+        dated = []
+        badge_rows = {}
+        for row, (username, date, badge) in enumerate(zip(
+                store.column("username_norm"), store.column("post_date"),
+                store.column("badge"))):
+            self.users.setdefault(username, []).append(row)
+            dated.append((date, row))
+            if badge:
+                badge_rows.setdefault(badge, []).append(row)
+        dated.sort()
+        self.dates = [date for date, _ in dated]
+        self.date_rows = [row for _, row in dated]
+        self.badges = {}
+        for badge, rows in badge_rows.items():
+            bits = bytearray((len(store) + 7) // 8)
+            for row in rows:
+                bits[row >> 3] |= 1 << (row & 7)
+            self.badges[badge] = int.from_bytes(bits, "little")
+
+    def rows(self, query):
+        """Filas que cumplen los filtros de la consulta, o None si no hay."""
+        row_sets = []
+        if query.users:
+            row_sets.append(set().union(
+                *(self.users.get(user, ()) for user in query.users)))
+        if query.after is not None or query.before is not None:
+            start = (bisect_left(self.dates, query.after)
+                     if query.after is not None else 0)
+            end = (bisect_left(self.dates, query.before)
+                   if query.before is not None else len(self.dates))
+            row_sets.append(self.date_rows[start:end])
+        if query.badges:
+            bitmap = 0
+            for badge in query.badges:
+                bitmap |= self.badges.get(badge, 0)
+            row_sets.append(bitmap_rows(bitmap))
+        if not row_sets:
+            return None
+        return intersect(row_sets)
+
+    def combine(self, query, term_rows):
+        """Filas candidatas: filtros de la consulta y candidatos de texto."""
+        row_sets = list(term_rows)
+        if query.has_filters():
+            row_sets.append(self.rows(query))
+        if not row_sets:
+            return range(len(self.date_rows))
+        return intersect(row_sets)
+
+
+class MaskFacetIndex(FacetIndex):
+    """FacetIndex que combina los filtros con máscaras booleanas de numpy."""
+
+    def __init__(self, store):
+        super().__init__(store)
+        count = len(store)
+        self.user_codes = numpy.zeros(count, dtype=numpy.int32)
+        for code, rows in enumerate(self.users.values()):
+            self.user_codes[rows] = code
+        self.user_code_of = {user: code
+                             for code, user in enumerate(self.users)}
+        self.post_dates = numpy.zeros(count, dtype=numpy.int64)
+        self.post_dates[self.date_rows] = self.dates
+        self.badge_codes = numpy.zeros(count, dtype=numpy.int8)
+        for badge, bitmap in self.badges.items():
+            self.badge_codes[sorted(bitmap_rows(bitmap))] = badge
+
+    def rows_mask(self, rows):
+        mask = numpy.zeros(len(self.user_codes), dtype=bool)
+        mask[numpy.fromiter(rows, dtype=numpy.intp)] = True
+        return mask
+
+    def mask(self, query):
+        """Máscara de los filtros de la consulta, o None si no hay."""
+        masks = []
+        if query.users:
+            codes = [self.user_code_of[user] for user in query.users
+                     if user in self.user_code_of]
+            masks.append(numpy.isin(self.user_codes, codes))
+        if query.after is not None:
+            masks.append(self.post_dates >= query.after)
+        if query.before is not None:
+            masks.append(self.post_dates < query.before)
+        if query.badges:
+            masks.append(numpy.isin(self.badge_codes, list(query.badges)))
+        if not masks:
+            return None
+        return numpy.logical_and.reduce(masks)
+
+    def rows(self, query):
+        mask = self.mask(query)
+        return None if mask is None else numpy.flatnonzero(mask).tolist()
+
+    def combine(self, query, term_rows):
+        mask = self.mask(query)
+        for rows in term_rows:
+            term_mask = self.rows_mask(rows)
+            mask = term_mask if mask is None else mask & term_mask
+        if mask is None:
+            return range(len(self.user_codes))
+        return numpy.flatnonzero(mask).tolist()
+
+
+def make_facet_index(store):
+    if numpy is not None:
+        return MaskFacetIndex(store)
+    return FacetIndex(store)
@@ -0,0 +1,45 @@
+from PySide6.QtCore import QObject, QThreadPool, Signal
+
+
+class SearchWorker(QObject):
+    """Ejecuta búsquedas fuera del hilo de la interfaz.
+
+    Cada búsqueda recibe un número de generación; al lanzar una nueva, las
+    anteriores se cancelan y sus resultados pendientes se descartan.
+    """
+    results_ready = Signal(int, list)
+    finished = Signal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.engine = None
+        self.generation = 0
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+
+    def set_engine(self, engine):
+        self.cancel()
+        self.engine = engine
+
+    def cancel(self, wait=True):
+        """Cancela la búsqueda en curso y, si se pide, espera a que termine."""
+        self.generation += 1
+        if wait:
+            self._pool.waitForDone()
+
+    def search(self, query):
+        self.generation += 1
+        generation = self.generation
+        engine = self.engine
+        if engine is not None:
+            self._pool.start(lambda: self._run(engine, query, generation))
+        return generation
+
+    def _run(self, engine, query, generation):
+        def cancelled():
+            return generation != self.generation
+
+        for rows in engine.search(query, cancelled):
+            self.results_ready.emit(generation, rows)
+        if not cancelled():
+            self.finished.emit(generation)
@@ -0,0 +1,109 @@
+import atexit
+import json
+import os
+import threading
+
+SETTINGS_FILE = "settings.json"
+DEFAULT_SETTINGS = {
+    "theme": "dark",
+    "json_file": "",
+}
+# Segundos sin cambios antes de escribir el archivo
+FLUSH_DELAY = 1.0
+
+
+class SettingsStore:
+    """Ajustes en memoria que se escriben a disco en diferido.
+
+    Cada cambio reinicia un temporizador; el archivo se escribe cuando pasa
+    FLUSH_DELAY sin cambios, al llamar a flush() y al salir. La escritura va
+    a un archivo temporal que luego sustituye al anterior, así que nunca
+    queda un settings.json a medio escribir. Las escrituras no se solapan y
+    una copia más antigua nunca sustituye a una más reciente.
+    """
+
+    def __init__(self, path=SETTINGS_FILE, delay=FLUSH_DELAY):
+        self.path = path
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._timer = None
+        self._dirty = False
+        # número de cambios hechos y el de la copia que está en disco
+        self._version = 0
+        self._written = 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self._values = json.load(f)
+        except (OSError, ValueError):
+            self._values = dict(DEFAULT_SETTINGS)
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._values.get(key, default)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def set(self, key, value):
+        with self._lock:
+            if key in self._values and self._values[key] == value:
+                return
+            self._values[key] = value
+            self._version += 1
+            self._dirty = True
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Escribe los cambios pendientes, si los hay.
+
+        Si otra escritura está en curso, espera a que termine: al volver,
+        lo pendiente está en disco.
+        """
+        # utils importa este módulo
+        from .utils import write_temp
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                values = dict(self._values)
+                version = self._version
+                self._dirty = False
+            if version <= self._written:
+                return
+            data = json.dumps(values, indent=2).encode("utf-8")
+            try:
+                tmp_file = write_temp(self.path, lambda f: f.write(data))
+                try:
+                    os.replace(tmp_file, self.path)
+                except OSError:
+                    os.remove(tmp_file)
+                    raise
+            except OSError:
+                with self._lock:
+                    self._dirty = True
+                return
+            self._written = version
+
+
+_settings = None
+_settings_lock = threading.Lock()
+
+
+def get_settings():
+    """Lee settings.json una sola vez; los cambios se guardan al salir."""
+    global _settings
+    if _settings is None:
+        with _settings_lock:
+            if _settings is None:
+                _settings = SettingsStore()
+                atexit.register(_settings.flush)
+    return _settings
@@ -0,0 +1,431 @@
+import hashlib
+import mmap
+import multiprocessing
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+from collections import deque
+from concurrent.futures import Future
+from itertools import accumulate
+
+from .json_stream import JsonArrayReader
+from .process_pool import make_executor
+from .utils import get_badge, make_preview, strip_accents, write_temp
+
+# Formato del archivo <hilo>.json.store:
+#   cabecera | tabla de posts (registros de ancho fijo) | blob de cadenas
+# Cada registro guarda los campos numéricos del post y, para cada cadena,
+# su desplazamiento y longitud (en bytes UTF-8) dentro del blob. Las cadenas
+# sólo se decodifican cuando se piden. La huella del post en el json permite
+# reutilizar lo ya normalizado cuando el hilo cambia. El resumen que muestra
+# la lista también se calcula al normalizar y se guarda con el post.
+STORE_MAGIC = b"KTST"
+STORE_VERSION = 4
+STORE_SUFFIX = ".store"
+
+# magic, versión, tamaño del json, mtime del json (ns), número de posts
+HEADER = struct.Struct("<4sIqqI")
+# post_id, thread_id, user_id, post_date, badge,
+# (offset, len) de message, message_norm, username, username_norm, preview,
+# longitud en caracteres de message_norm, huella del post en el json
+RECORD = struct.Struct("<qqqqI10II8s")
+
+INT_FIELDS = ("post_id", "thread_id", "user_id", "post_date", "badge")
+STR_FIELDS = ("message", "message_norm", "username", "username_norm",
+              "preview")
+POST_FIELDS = frozenset(INT_FIELDS + STR_FIELDS)
+# cadenas que se repiten entre posts y se guardan una sola vez en memoria
+SHARED_FIELDS = ("username", "username_norm")
+STR_SLOT = len(INT_FIELDS)
+NORM_LEN_SLOT = STR_SLOT + 2 * len(STR_FIELDS)
+FINGERPRINT_SLOT = NORM_LEN_SLOT + 1
+
+# campos numéricos del json y longitud del mensaje, al calcular la huella
+FINGERPRINT_HEADER = struct.Struct("<qqqqQ")
+
+# Posts por lote que se entregan mientras se reconstruye el almacén
+POST_BATCH = 50
+
+# Normalización en paralelo: posts por trozo, trozos en vuelo y tamaño del
+# json a partir del cual compensa arrancar procesos para una carga en frío
+NORMALIZE_CHUNK = 64
+CHUNKS_IN_FLIGHT = 8
+PARALLEL_MIN_SIZE = 1 << 20
+
+
+class PostRecord:
+    """Post normalizado, con los campos del almacén como atributos.
+
+    Mientras no hay almacén (durante la carga) se usa en su lugar, como un
+    dict, igual que StoredPost.
+    """
+    __slots__ = INT_FIELDS + STR_FIELDS
+
+    def __init__(self, post_id, thread_id, user_id, post_date, badge,
+                 message, message_norm, username, username_norm, preview):
+        self.post_id = post_id
+        self.thread_id = thread_id
+        self.user_id = user_id
+        self.post_date = post_date
+        self.badge = badge
+        self.message = message
+        self.message_norm = message_norm
+        self.username = username
+        self.username_norm = username_norm
+        self.preview = preview
+
+    def __reduce__(self):
+        return PostRecord, tuple(getattr(self, k) for k in self.__slots__)
+
+    def __getitem__(self, key):
+        if key not in POST_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        if key not in POST_FIELDS:
+            return default
+        return getattr(self, key)
+
+
+class StoredPost:
+    """Vista perezosa de un post del almacén; se usa como un dict."""
+    __slots__ = ("_store", "_row")
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, key):
+        return self._store.field(self._row, key)
+
+    def get(self, key, default=None):
+        try:
+            return self._store.field(self._row, key)
+        except KeyError:
+            return default
+
+
+class ThreadStore:
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.source_size, self.source_mtime, self.count = (
+            HEADER.unpack_from(self._mm, 0))
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            self._mm.close()
+            raise ValueError(f"{path} no es un almacén válido")
+        self._blob = HEADER.size + self.count * RECORD.size
+        self._load_columns()
+
+    def _load_columns(self):
+        """Lee la tabla una vez y la guarda por columnas.
+
+        Los campos numéricos quedan en arrays y los nombres de usuario, que
+        se repiten en casi todos los posts, como una cadena compartida por
+        todas sus filas. Los mensajes se siguen leyendo del blob al pedirlos.
+        """
+        table = memoryview(self._mm)[HEADER.size:self._blob]
+        try:
+            slots = (list(zip(*RECORD.iter_unpack(table)))
+                     or [()] * (FINGERPRINT_SLOT + 1))
+        finally:
+            table.release()
+        self._columns = {name: array("q", slots[i])
+                         for i, name in enumerate(INT_FIELDS)}
+        self._spans = {}
+        names = {}
+        for i, name in enumerate(STR_FIELDS):
+            offsets = array("I", slots[STR_SLOT + 2 * i])
+            lengths = array("I", slots[STR_SLOT + 2 * i + 1])
+            if name not in SHARED_FIELDS:
+                self._spans[name] = offsets, lengths
+                continue
+            column = []
+            for offset, length in zip(offsets, lengths):
+                start = self._blob + offset
+                raw = self._mm[start:start + length]
+                value = names.get(raw)
+                if value is None:
+                    value = names[raw] = sys.intern(raw.decode("utf-8"))
+                column.append(value)
+            self._columns[name] = column
+        # longitud de message_norm acumulada hasta cada fila, incluida
+        self._norm_prefix = array("Q", accumulate(slots[NORM_LEN_SLOT]))
+        self._post_rows = None
+
+    @classmethod
+    def open(cls, json_file, on_posts=None, cancelled=None, executor=None):
+        """Abre el almacén de un hilo, reconstruyéndolo si el json cambió.
+
+        Si el tamaño y la fecha del json coinciden con los guardados, el
+        almacén se usa tal cual. Si no, se reconstruye aprovechando los posts
+        del almacén anterior cuya huella no cambió, de modo que añadir posts
+        al final sólo cuesta normalizar los nuevos.
+
+        Al reconstruirlo, `on_posts(posts, leídos, total)` recibe los posts
+        por lotes según se normalizan, con los bytes del json leídos hasta
+        entonces y su tamaño. Devuelve None si `cancelled()` corta
+        la reconstrucción. `executor` reparte la normalización entre
+        procesos (ver build_store).
+        """
+        stat = os.stat(json_file)
+        store_file = json_file + STORE_SUFFIX
+        previous = None
+        if os.path.exists(store_file):
+            try:
+                previous = cls(store_file)
+            except (ValueError, struct.error):
+                pass
+            else:
+                if (previous.source_size == stat.st_size
+                        and previous.source_mtime == stat.st_mtime_ns):
+                    return previous
+        if not build_store(json_file, store_file, on_posts, cancelled,
+                           previous, executor):
+            return None
+        return cls(store_file)
+
+    def close(self):
+        self._mm.close()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += self.count
+        if not 0 <= row < self.count:
+            raise IndexError(row)
+        return StoredPost(self, row)
+
+    def __iter__(self):
+        for row in range(self.count):
+            yield StoredPost(self, row)
+
+    def column(self, name):
+        """Valores de un campo numérico o de usuario, por fila."""
+        return self._columns[name]
+
+    def field(self, row, name):
+        column = self._columns.get(name)
+        if column is not None:
+            return column[row]
+        spans = self._spans.get(name)
+        if spans is None:
+            raise KeyError(name)
+        start = self._blob + spans[0][row]
+        return self._mm[start:start + spans[1][row]].decode("utf-8")
+
+    def post_fields(self, row):
+        """Todos los campos de una fila, como los da `normalize_post`."""
+        return PostRecord(*(self.field(row, name)
+                            for name in INT_FIELDS + STR_FIELDS))
+
+    def fingerprints(self):
+        """Huella de cada post → fila."""
+        table = memoryview(self._mm)[HEADER.size:self._blob]
+        try:
+            return {r[FINGERPRINT_SLOT]: row
+                    for row, r in enumerate(RECORD.iter_unpack(table))}
+        finally:
+            table.release()
+
+    def prefix_digest(self, count):
+        """Huella del contenido de las primeras `count` filas."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self._mm[HEADER.size:HEADER.size + count * RECORD.size])
+        if count:
+            record = RECORD.unpack_from(
+                self._mm, HEADER.size + (count - 1) * RECORD.size)
+            end = max(record[i] + record[i + 1]
+                      for i in range(STR_SLOT, NORM_LEN_SLOT, 2))
+            digest.update(self._mm[self._blob:self._blob + end])
+        return digest.digest()
+
+    def post_rows(self):
+        """post_id → fila; se calcula la primera vez que se pide."""
+        if self._post_rows is None:
+            post_ids = self._columns["post_id"]
+            # si un post_id se repite, vale su primera fila
+            self._post_rows = {post_ids[row]: row
+                               for row in reversed(range(self.count))}
+        return self._post_rows
+
+    def row_of_post(self, post_id):
+        return self.post_rows().get(post_id, -1)
+
+    def norm_length_through(self, row):
+        """Longitud de message_norm de las filas hasta `row`, incluida."""
+        return self._norm_prefix[row] if row >= 0 else 0
+
+    def total_norm_length(self):
+        return self._norm_prefix[-1] if self.count else 0
+
+
+def post_fingerprint(msg):
+    """Huella del contenido de un post del json."""
+    message = msg["message"].encode("utf-8")
+    digest = hashlib.blake2b(FINGERPRINT_HEADER.pack(
+        *(int(msg.get(k) or 0) for k in INT_FIELDS[:-1]), len(message)),
+        digest_size=8)
+    digest.update(message)
+    digest.update(msg["username"].encode("utf-8"))
+    return digest.digest()
+
+
+def normalize_post(msg):
+    """Post del json con los campos que guarda el almacén."""
+    message = msg["message"]
+    message_norm = strip_accents(message.lower())
+    username = msg["username"]
+    return PostRecord(
+        *(int(msg.get(k) or 0) for k in INT_FIELDS[:-1]),
+        get_badge(message), message, message_norm,
+        sys.intern(username), sys.intern(strip_accents(username.lower())),
+        make_preview(message_norm))
+
+
+def normalize_posts(msgs):
+    """normalize_post sobre un trozo de posts; se usa en otros procesos."""
+    return [normalize_post(msg) for msg in msgs]
+
+
+def _normalized(reader, previous, executor):
+    """Genera (post, huella) en el orden del json.
+
+    Los posts cuya huella ya está en `previous` se copian de él; el resto se
+    normaliza por trozos, repartidos en `executor` si lo hay. El primer trozo
+    y los que casi no traen posts nuevos se normalizan aquí: así la lista
+    tiene algo que mostrar mientras arrancan los procesos.
+    """
+    known = previous.fingerprints() if previous is not None else {}
+    pending = deque()
+
+    def submit(chunk):
+        new = [msg for msg, _, row in chunk if row is None]
+        if (executor is None or not submitted
+                or len(new) < NORMALIZE_CHUNK // 2):
+            return chunk, normalize_posts(new)
+        return chunk, executor.submit(normalize_posts, new)
+
+    def ready(result):
+        return not isinstance(result, Future) or result.done()
+
+    def finish(chunk, result):
+        if isinstance(result, Future):
+            result = result.result()
+        normalized = iter(result)
+        for msg, fingerprint, row in chunk:
+            if row is None:
+                yield next(normalized), fingerprint
+            else:
+                yield previous.post_fields(row), fingerprint
+
+    submitted = False
+    chunk = []
+    for msg in reader:
+        fingerprint = post_fingerprint(msg)
+        chunk.append((msg, fingerprint, known.get(fingerprint)))
+        if len(chunk) < NORMALIZE_CHUNK:
+            continue
+        pending.append(submit(chunk))
+        submitted = True
+        chunk = []
+        while pending and (len(pending) > CHUNKS_IN_FLIGHT
+                           or ready(pending[0][1])):
+            yield from finish(*pending.popleft())
+    if chunk:
+        pending.append(submit(chunk))
+    while pending:
+        yield from finish(*pending.popleft())
+
+
+def build_store(json_file, store_file, on_posts=None, cancelled=None,
+                previous=None, executor=None):
+    """Escribe el almacén del hilo; devuelve False si se canceló.
+
+    Los posts se leen del json uno a uno y pasan directamente a la tabla; las
+    cadenas se van escribiendo en un archivo temporal, así que en memoria
+    sólo queda la tabla de registros. De `previous`, el almacén anterior, se
+    copian los posts con la misma huella en lugar de normalizarlos de nuevo;
+    se cierra antes de sustituir el archivo.
+
+    La normalización se reparte en `executor`. Si no se da uno, se crea para
+    las cargas en frío de hilos grandes cuando hay más de un núcleo.
+    """
+    stat = os.stat(json_file)
+    own_executor = (executor is None and previous is None
+                    and stat.st_size >= PARALLEL_MIN_SIZE
+                    and (os.cpu_count() or 1) > 1
+                    and multiprocessing.parent_process() is None)
+    if own_executor:
+        executor = make_executor()
+    try:
+        reader = JsonArrayReader(json_file)
+        table = bytearray()
+        count = 0
+        batch = []
+        with tempfile.TemporaryFile() as blob:
+            blob_len = 0
+            for post, fingerprint in _normalized(reader, previous, executor):
+                spans = []
+                for name in STR_FIELDS:
+                    encoded = getattr(post, name).encode("utf-8")
+                    spans += [blob_len, len(encoded)]
+                    blob.write(encoded)
+                    blob_len += len(encoded)
+                table += RECORD.pack(
+                    *(getattr(post, k) for k in INT_FIELDS), *spans,
+                    len(post.message_norm), fingerprint)
+                count += 1
+                if on_posts is not None:
+                    batch.append(post)
+                    if len(batch) == POST_BATCH:
+                        on_posts(batch, reader.position, stat.st_size)
+                        batch = []
+                if cancelled is not None and cancelled():
+                    return False
+            if batch:
+                on_posts(batch, reader.position, stat.st_size)
+
+            def write(f):
+                f.write(HEADER.pack(STORE_MAGIC, STORE_VERSION, stat.st_size,
+                                    stat.st_mtime_ns, count))
+                f.write(table)
+                blob.seek(0)
+                shutil.copyfileobj(blob, f)
+
+            # temporal propio: otros procesos pueden estar escribiendo el
+            # mismo almacén a la vez
+            tmp_file = write_temp(store_file, write)
+    finally:
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
+        if previous is not None:
+            previous.close()
+    try:
+        os.replace(tmp_file, store_file)
+    except OSError:
+        # En Windows falla si otro proceso ya dejó el suyo y lo tiene abierto;
+        # vale el suyo si corresponde a este mismo json
+        os.remove(tmp_file)
+        if not store_is_current(store_file, stat):
+            raise
+    return True
+
+
+def store_is_current(store_file, stat):
+    """Si el almacén es de este formato y del json con ese `stat`."""
+    try:
+        with open(store_file, "rb") as f:
+            header = HEADER.unpack(f.read(HEADER.size))
+    except (OSError, struct.error):
+        return False
+    return header[:4] == (STORE_MAGIC, STORE_VERSION, stat.st_size,
+                          stat.st_mtime_ns)
@@ -1,11 +1,11 @@
-import json
 import os
 import re
+import tempfile
 from datetime import datetime
 
 import unicodedata
 
-SETTINGS_FILE = "settings.json"
+from .settings_store import get_settings
 
 
 def format_date(ts):
@@ -19,47 +19,137 @@ def strip_bbcode(text: str) -> str:
     """Elimina tags BBCode simples"""
     return re.sub(r"\[/?[^\]]+\]", "", text).strip()
 
+BADGE_NONE = 0
+BADGE_UPDATE = 1
+BADGE_MINI_UPDATE = 2
+
+BADGE_NAMES = {
+    "actualizacion": BADGE_UPDATE,
+    "miniactualizacion": BADGE_MINI_UPDATE,
+}
+
+def get_badge(message: str) -> int:
+    """Tipo de actualización que anuncia el mensaje, según cómo empieza"""
+    clean_message = strip_bbcode(message).lstrip().lower()
+    if (clean_message.startswith("miniactualización")
+            or clean_message.startswith("miniactualizacion")):
+        return BADGE_MINI_UPDATE
+    if (clean_message.startswith("actualización")
+            or clean_message.startswith("actualizacion")
+            or clean_message.startswith("interludio")):
+        return BADGE_UPDATE
+    return BADGE_NONE
+
+PREVIEW_LENGTH = 280
+PREVIEW_TAG = re.compile(r"\[.*?]")
+# texto fuera de tags que se lee antes de intentar cortar el mensaje
+PREVIEW_SCAN = 2 * PREVIEW_LENGTH
+
+def make_preview(text: str) -> str:
+    """Resumen de un mensaje para la lista, sin tags BBCode.
+
+    Sólo se quitan los tags del principio del mensaje: fuera de un tag se
+    puede cortar sin cambiar lo que queda antes, y si tras el corte hay más
+    de PREVIEW_LENGTH caracteres sin espacios al final, el resto no cuenta.
+    """
+    seen = 0
+    pos = 0
+    for tag in PREVIEW_TAG.finditer(text):
+        if seen + tag.start() - pos > PREVIEW_SCAN:
+            break
+        seen += tag.start() - pos
+        pos = tag.end()
+    cut = pos + PREVIEW_SCAN - seen
+    preview = PREVIEW_TAG.sub("", text[:cut]).strip()
+    if len(preview) <= PREVIEW_LENGTH and cut < len(text):
+        preview = PREVIEW_TAG.sub("", text).strip()
+    return preview.replace("\n", " ")[:PREVIEW_LENGTH] + "..."
+
+USER_COLORS = {
+    'pali': "#638db6",
+    'riaj': "#638db6",
+    'xavier': "#fb6160",
+    'regol': "#fb6160",
+    'säbel': "#ff5694",
+    'zafiro bladen': "#ac97ff",
+    'soria': "#65bdf3",
+    'legend': "#85de85",
+    'furanku': "#faa351",
+    'vichoxd': "#62d4e3",
+}
+
 def get_user_color(user):
-    colors = {
-        'pali': "#638db6",
-        'riaj': "#638db6",
-        'xavier': "#fb6160",
-        'regol': "#fb6160",
-        'säbel': "#ff5694",
-        'zafiro bladen': "#ac97ff",
-        'soria': "#65bdf3",
-        'legend': "#85de85",
-        'furanku': "#faa351",
-        'vichoxd': "#62d4e3",
-    }
-    return colors.get(user.lower(), "#7f8c8d")
+    return USER_COLORS.get(user.lower(), "#7f8c8d")
+
+def write_temp(path, write):
+    """Escribe con `write(f)` un temporal único junto a `path`.
+
+    Devuelve su nombre, para sustituir `path` con os.replace.
+    """
+    fd, tmp_file = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".",
+        prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+    return tmp_file
 
 def save_setting(key, value):
-    if os.path.exists(SETTINGS_FILE):
-        with open(SETTINGS_FILE, "r", encoding="utf-8") as f:
-            settings = json.load(f)
-    else:
-        settings = {}
-    settings[key] = value
-    with open(SETTINGS_FILE, "w", encoding="utf-8") as f:
-        json.dump(settings, f, indent=2)
+    get_settings().set(key, value)
 
 def load_settings():
-    if os.path.exists(SETTINGS_FILE):
-        with open(SETTINGS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    defaults = {
-        "theme": "dark",
-        "json_file": "",
-    }
-    return defaults  # valor por defecto
+    return get_settings().snapshot()
 
-def strip_accents(s: str) -> str:
+def strip_accents_nfd(s: str) -> str:
     return ''.join(
         c for c in unicodedata.normalize('NFD', s)
         if unicodedata.category(c) != 'Mn'
     )
 
+# Caracteres con el plegado precalculado; el resto pasa por la NFD
+FOLD_LIMIT = 0x3000
+_fold = None
+
+def _fold_table():
+    """Plegado carácter a carácter equivalente a strip_accents_nfd.
+
+    Devuelve {carácter: plegado} y una expresión que encuentra los caracteres
+    que cambian y los que no tienen plegado precalculado. Quitar las marcas
+    carácter a carácter da lo mismo que hacerlo sobre la cadena entera salvo
+    si la NFD reordena combinantes que no son Mn; los caracteres que los
+    contienen se dejan fuera de la tabla.
+    """
+    global _fold
+    if _fold is None:
+        table = {}
+        unsafe = []
+        for code in range(0x80, FOLD_LIMIT):
+            c = chr(code)
+            decomposed = unicodedata.normalize('NFD', c)
+            if any(unicodedata.combining(d)
+                   and unicodedata.category(d) != 'Mn' for d in decomposed):
+                unsafe.append(c)
+                continue
+            folded = strip_accents_nfd(c)
+            if folded != c:
+                table[c] = folded
+        chars = ''.join(re.escape(c) for c in list(table) + unsafe)
+        others = f"[^\\x00-{chr(FOLD_LIMIT - 1)}]"
+        _fold = table, re.compile(f"[{chars}]|{others}")
+    return _fold
+
+def strip_accents(s: str) -> str:
+    if s.isascii():
+        return s
+    table, pattern = _fold_table()
+    try:
+        return pattern.sub(lambda m: table[m.group()], s)
+    except KeyError:  # carácter sin plegado precalculado
+        return strip_accents_nfd(s)
+
 ACCENT_GROUPS = {
     "a": "aáàäâ",
     "e": "eéèëê",
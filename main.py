@@ -1,3 +1,4 @@
+import multiprocessing
 import sys
 
 from PySide6.QtWidgets import QApplication
@@ -6,6 +7,7 @@ from keaton import Keaton
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     viewer = Keaton(app)
     viewer.show()
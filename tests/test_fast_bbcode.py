@@ -0,0 +1,50 @@
+"""El renderizador propio debe dar el mismo HTML que bbcode_parser."""
+import json
+from pathlib import Path
+
+import pytest
+
+from keaton.fast_bbcode import compare_with_reference
+
+THREADS_DIR = Path(__file__).resolve().parent.parent / "threads"
+THREAD_FILES = sorted(THREADS_DIR.glob("*.json"))
+
+EDGE_CASES = [
+    "",
+    "texto sin etiquetas",
+    "[b][i]anidadas[/i][/b]",
+    "[b][i]cruzadas[/b][/i]",
+    "[quote][quote]cita dentro de cita[/quote][/quote]",
+    "[b]sin cerrar",
+    "[/b]cierre suelto",
+    "[",
+    "[b",
+    "[color=#3366cc]mapeado[/color]",
+    "[color=red]por nombre[/color]",
+    "[color=#zzzzzz]color inválido[/color]",
+    "[color=]vacío[/color]",
+    "[color=javascript:alert(1)]x[/color]",
+    "[url]example.com[/url]",
+    "[url]http://example.com[/url]",
+    "[url=example.com]sin esquema[/url]",
+    "[url=javascript:alert(1)]x[/url]",
+    "<b>&amp; escapes</b> \"comillas\"",
+    "línea\nsegunda línea\n\n",
+    "[list][*]uno[*]dos[/list]",
+    "[B]mayúsculas[/B]",
+]
+
+
+@pytest.mark.parametrize("message", EDGE_CASES)
+def test_edge_cases(message):
+    assert list(compare_with_reference([message])) == []
+
+
+@pytest.mark.skipif(not THREAD_FILES, reason="no hay hilos en threads/")
+@pytest.mark.parametrize("thread_file", THREAD_FILES, ids=lambda p: p.name)
+def test_thread_posts(thread_file):
+    with open(thread_file, encoding="utf-8") as f:
+        posts = json.load(f)
+    differing = [posts[index]["post_id"] for index, _, _ in
+                 compare_with_reference(post["message"] for post in posts)]
+    assert differing == []